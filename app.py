@@ -1,25 +1,99 @@
-import json
+import os
 import random
 import time
 import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional
 
+import orjson
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 
-from model2 import AdvancedPredictionModel, BasePredictionModel, train_and_evaluate
-
-app = FastAPI(
-    title="Nocarz Offer Suggestion Service",
-    description="API for suggesting form fields.",
-    version="1.0.0",
+from model2 import (
+    AdvancedPredictionModel,
+    BasePredictionModel,
+    NeighboursPredictionModel,
+    OnlinePredictionModel,
 )
+from monitoring import DriftMonitor
+from online import OnlineLearner
 
 base_model = BasePredictionModel()
 advanced_model = AdvancedPredictionModel()
+neighbours_model = NeighboursPredictionModel()
+online_model = OnlinePredictionModel()
+online_learner = None
+drift_monitor = DriftMonitor()
 PREDICTION_LOG_FILE = "ab_test_logs.jsonl"
 FEEDBACK_LOG_FILE = "feedback_logs.jsonl"
+MODELS_PATH = "models.pkl"
+NEIGHBOURS_INDEX_PATH = "neighbours_index.pkl"
+ONLINE_MODEL_PATH = "online_model.pkl"
+ONLINE_STATE_PATH = "online_state.pkl"
+# Disabled by the pre-fork supervisor (serve.py), where workers only serve.
+ONLINE_LEARNING = True
+
+
+def load_models(mmap_mode=None):
+    """
+    Loads saved models into a worker that did not train them itself
+    (e.g. `uvicorn app:app --workers N`). Models already trained in this
+    process are kept.
+    With mmap_mode="r" the weight arrays are memory-mapped read-only from
+    the files, so processes loading the same files share them.
+    Artifacts are replaced atomically, so retraining never changes what a
+    running process has mapped: it keeps serving the old weights until it is
+    restarted. Only the online model follows retrains while running, and only
+    in processes running an OnlineLearner.
+    """
+    global base_model, advanced_model, neighbours_model, online_model, drift_monitor
+    import joblib
+
+    if not advanced_model.heads and os.path.exists(MODELS_PATH):
+        artifacts = joblib.load(MODELS_PATH, mmap_mode=mmap_mode)
+        base_model = artifacts["base_model"]
+        advanced_model = artifacts["advanced_model"]
+        if "drift_monitor" in artifacts:
+            drift_monitor = artifacts["drift_monitor"]
+    if neighbours_model.index is None and os.path.exists(NEIGHBOURS_INDEX_PATH):
+        neighbours_model = NeighboursPredictionModel.load(
+            NEIGHBOURS_INDEX_PATH, mmap_mode=mmap_mode
+        )
+    if not online_model.heads and os.path.exists(ONLINE_MODEL_PATH):
+        online_model = joblib.load(ONLINE_MODEL_PATH, mmap_mode=mmap_mode)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Loads saved models and starts the background online learner once the
+    online model is trained.
+    """
+    global online_learner
+    load_models()
+    if ONLINE_LEARNING and online_model.heads:
+        online_learner = OnlineLearner(
+            online_model,
+            PREDICTION_LOG_FILE,
+            FEEDBACK_LOG_FILE,
+            save_path=ONLINE_MODEL_PATH,
+            state_path=ONLINE_STATE_PATH,
+        )
+        online_learner.start()
+    yield
+    if online_learner is not None:
+        online_learner.stop()
+
+
+app = FastAPI(
+    title="Nocarz Offer Suggestion Service",
+    description="API for suggesting form fields.",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
 
 
 class OfferRequest(BaseModel):
@@ -35,6 +109,7 @@ class OfferResponse(BaseModel):
     beds: Optional[float] = None
     accommodates: Optional[float] = None
     amenities: List[str] = []
+    confidence: Dict[str, float] = {}
     model_version: str
 
 
@@ -56,19 +131,28 @@ def log_prediction(
         "prediction_id": pred_id,
         "timestamp": datetime.now().isoformat(),
         "model_used": model_name,
+        "description": description,
         "input_length": len(description),
         "prediction": result,
         "processing_time_ms": round(duration * 1000, 2),
     }
-    with open(PREDICTION_LOG_FILE, "a") as f:
-        f.write(json.dumps(log_entry) + "\n")
+    with open(PREDICTION_LOG_FILE, "ab") as f:
+        # Model results are read-only mappings; orjson falls back to dict().
+        f.write(orjson.dumps(log_entry, default=dict) + b"\n")
 
 
-def _prepare_response(result_dict: dict, model_ver: str, pred_id: str) -> dict:
-    if "amenities" not in result_dict or result_dict["amenities"] is None:
-        result_dict["amenities"] = []
+def _prepare_response(result: dict, model_ver: str, pred_id: str) -> ORJSONResponse:
+    """
+    Builds the response without mutating the model output.
+    Model outputs are already typed, so the response is serialized directly
+    instead of being re-validated against OfferResponse (kept for the docs).
+    """
+    payload = {**result, "model_version": model_ver, "prediction_id": pred_id}
+    if payload.get("amenities") is None:
+        payload["amenities"] = []
+    payload["confidence"] = dict(payload.get("confidence") or {})
 
-    return {**result_dict, "model_version": model_ver, "prediction_id": pred_id}
+    return ORJSONResponse(payload)
 
 
 @app.post("/app/predict/baseline", response_model=OfferResponse)
@@ -78,6 +162,7 @@ async def predict_baseline(offer: OfferRequest):
     """
     prediction_id = str(uuid.uuid4())
     result = base_model.predict(offer.description)
+    drift_monitor.observe(offer.description, result, "baseline")
     return _prepare_response(result, "baseline_forced", prediction_id)
 
 
@@ -88,9 +173,52 @@ async def predict_advanced(offer: OfferRequest):
     """
     prediction_id = str(uuid.uuid4())
     result = advanced_model.predict(offer.description)
+    drift_monitor.observe(offer.description, result, "advanced")
     return _prepare_response(result, "advanced_forced", prediction_id)
 
 
+@app.post("/app/predict/tiered", response_model=OfferResponse)
+async def predict_tiered(offer: OfferRequest):
+    """
+    Uses keyword rules for fields they answer reliably and the advanced ML
+    model for the rest.
+    """
+    prediction_id = str(uuid.uuid4())
+    result = advanced_model.predict_tiered(offer.description)
+    drift_monitor.observe(offer.description, result, "tiered")
+    return _prepare_response(result, "tiered_forced", prediction_id)
+
+
+@app.post("/app/predict/neighbours", response_model=OfferResponse)
+async def predict_neighbours(offer: OfferRequest):
+    """
+    Uses nearest-neighbour retrieval over training listings (fast mode).
+    """
+    prediction_id = str(uuid.uuid4())
+    result = neighbours_model.predict(offer.description)
+    drift_monitor.observe(offer.description, result, "neighbours")
+    return _prepare_response(result, "neighbours_forced", prediction_id)
+
+
+@app.post("/app/predict/online", response_model=OfferResponse)
+async def predict_online(offer: OfferRequest):
+    """
+    Uses the latest published version of the model learning from feedback.
+    It saves results into logs, so feedback can be joined to the description.
+    """
+    start_time = time.time()
+    prediction_id = str(uuid.uuid4())
+    model = online_learner.model if online_learner is not None else online_model
+
+    result = model.predict(offer.description)
+    drift_monitor.observe(offer.description, result, "online")
+
+    duration = time.time() - start_time
+    log_prediction(prediction_id, offer.description, result, "online", duration)
+
+    return _prepare_response(result, result["model_version"], prediction_id)
+
+
 @app.post("/app/predict/ab_test", response_model=OfferResponse)
 async def predict_ab_test(offer: OfferRequest):
     """
@@ -109,6 +237,7 @@ async def predict_ab_test(offer: OfferRequest):
         model_name = "advanced"
 
     result = model.predict(offer.description)
+    drift_monitor.observe(offer.description, result, model_name)
 
     duration = time.time() - start_time
     log_prediction(prediction_id, offer.description, result, model_name, duration)
@@ -124,12 +253,34 @@ async def save_feedback(feedback: FeedbackRequest):
     log_entry = feedback.dict()
     log_entry["timestamp"] = datetime.now().isoformat()
 
-    with open(FEEDBACK_LOG_FILE, "a") as f:
-        f.write(json.dumps(log_entry) + "\n")
+    with open(FEEDBACK_LOG_FILE, "ab") as f:
+        f.write(orjson.dumps(log_entry) + b"\n")
 
     return {"status": "feedback_saved", "id": feedback.prediction_id}
 
 
+@app.get("/app/online/status", tags=["System"])
+def online_status():
+    if online_learner is None:
+        return {"running": False, "model_version": online_model.version}
+    return {
+        "running": True,
+        "learning": online_learner.leader,
+        "lineage": online_learner.model.lineage,
+        "model_version": online_learner.model.version,
+        **online_learner.stats,
+    }
+
+
+@app.get("/app/monitor/drift", tags=["System"])
+def drift_status():
+    """
+    Live input sketches and per-model prediction sketches vs the training
+    data, with PSI per sketch.
+    """
+    return drift_monitor.snapshot()
+
+
 @app.get("/app/health", tags=["System"])
 def health_check():
     return {"status": "ok"}
@@ -138,7 +289,19 @@ def health_check():
 if __name__ == "__main__":
     import uvicorn
 
-    train_and_evaluate(base_model=base_model, advanced_model=advanced_model)
+    from training import train_and_evaluate
+
+    train_and_evaluate(
+        base_model=base_model,
+        advanced_model=advanced_model,
+        neighbours_model=neighbours_model,
+        online_model=online_model,
+        save_path=MODELS_PATH,
+        index_path=NEIGHBOURS_INDEX_PATH,
+        online_path=ONLINE_MODEL_PATH,
+        online_state_path=ONLINE_STATE_PATH,
+        drift_monitor=drift_monitor,
+    )
 
     print("\n=================================================")
     print(f" LOGS of A/B experiment go to: {PREDICTION_LOG_FILE}")
@@ -0,0 +1,584 @@
+import argparse
+import asyncio
+import json
+import os
+import pickle
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import List, Optional
+
+import orjson
+import pandas as pd
+from fastapi import FastAPI
+from pydantic import BaseModel
+from sklearn.model_selection import train_test_split
+
+import app as service
+from model2 import (
+    AdvancedPredictionModel,
+    NeighboursPredictionModel,
+    apply_keyword_rule,
+    extract_amenities_from_description,
+)
+from serve import report_memory
+from training import fit_drift_reference, score_model, served_predictors
+
+CSV_PATH = "listings1.csv"
+SAMPLE_DESCRIPTION = "Cozy apartment in the city center with 2 bedrooms and wifi."
+
+
+async def call_asgi(asgi_app, path: str, body: bytes) -> bytes:
+    """
+    Sends a single POST request straight through the ASGI app, without
+    any network or HTTP client in between.
+    """
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 5000),
+        "server": ("127.0.0.1", 8080),
+    }
+    chunks = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await asgi_app(scope, receive, send)
+    return b"".join(chunks)
+
+
+def time_calls(func, repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def time_calls_over(func, inputs: list) -> List[float]:
+    timings = []
+    for item in inputs:
+        start = time.perf_counter()
+        func(item)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def time_asgi_calls(asgi_app, path: str, body: bytes, repeat: int) -> List[float]:
+    async def run():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            await call_asgi(asgi_app, path, body)
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+    return asyncio.run(run())
+
+
+def print_timings(label: str, timings: List[float]):
+    print(
+        f"  {label:<28} mean={statistics.mean(timings):.3f} ms  "
+        f"median={statistics.median(timings):.3f} ms  "
+        f"p95={sorted(timings)[int(len(timings) * 0.95)]:.3f} ms"
+    )
+
+
+def build_legacy_app(model) -> FastAPI:
+    """
+    Rebuilds the previous response path: response_model validation,
+    jsonable_encoder and the default JSON encoder.
+    """
+    legacy_app = FastAPI()
+
+    class LegacyOfferResponse(BaseModel):
+        prediction_id: str
+        room_type: Optional[str] = None
+        property_type: Optional[str] = None
+        bathrooms_text: Optional[str] = None
+        bedrooms: Optional[float] = None
+        beds: Optional[float] = None
+        accommodates: Optional[float] = None
+        amenities: List[str] = []
+        model_version: str
+
+    @legacy_app.post("/app/predict/baseline", response_model=LegacyOfferResponse)
+    async def predict_baseline(offer: service.OfferRequest):
+        result = dict(model.predict(offer.description))
+        return {**result, "model_version": "baseline_forced", "prediction_id": "x"}
+
+    return legacy_app
+
+
+def bench_response(repeat: int):
+    print(f"Fitting baseline model on {CSV_PATH}...")
+    service.base_model.learn(pd.read_csv(CSV_PATH))
+
+    body = orjson.dumps({"description": SAMPLE_DESCRIPTION})
+    path = "/app/predict/baseline"
+    legacy_app = build_legacy_app(service.base_model)
+
+    print(f"\n--- Baseline route, {repeat} requests ---")
+    model_only = time_calls(
+        lambda: service.base_model.predict(SAMPLE_DESCRIPTION), repeat
+    )
+    legacy = time_asgi_calls(legacy_app, path, body, repeat)
+    current = time_asgi_calls(service.app, path, body, repeat)
+
+    print_timings("model.predict only", model_only)
+    print_timings("legacy response path", legacy)
+    print_timings("current response path", current)
+
+    legacy_overhead = statistics.mean(legacy) - statistics.mean(model_only)
+    current_overhead = statistics.mean(current) - statistics.mean(model_only)
+    print(
+        f"\n  Framework overhead per request: {legacy_overhead:.3f} ms -> "
+        f"{current_overhead:.3f} ms"
+    )
+
+
+def _predict_batch(model_bytes: bytes, descriptions: List[str]) -> List[dict]:
+    model = pickle.loads(model_bytes)
+    # Read-only results cannot be pickled back to the parent process.
+    return [dict(model.predict(description)) for description in descriptions]
+
+
+def bench_concurrency(requests: int, workers: int):
+    """
+    Fires many concurrent predictions with different descriptions and checks
+    that every result carries its own amenities, cannot be modified and the
+    shared template is left untouched.
+    """
+    print(f"Fitting baseline model on {CSV_PATH}...")
+    model = service.base_model.learn(pd.read_csv(CSV_PATH))
+    template_before = dict(model.response_template)
+
+    df = pd.read_csv(CSV_PATH).dropna(subset=["description"])
+    descriptions = df["description"].sample(
+        requests, replace=True, random_state=0
+    ).tolist()
+    expected = [extract_amenities_from_description(d) for d in descriptions]
+
+    def check(results: List[dict], label: str, frozen: bool = True):
+        leaked = sum(
+            list(result["amenities"]) != amenities
+            for result, amenities in zip(results, expected)
+        )
+        shared = len({id(result) for result in results}) != len(results)
+        mutable = 0
+        for result in results if frozen else ():
+            try:
+                result["model_version"] = "tampered"
+                mutable += 1
+            except TypeError:
+                pass
+        status = "OK" if leaked == 0 and not shared and not mutable else "FAILED"
+        print(
+            f"  {label:<28} leaked={leaked} shared_objects={shared} "
+            f"mutable={mutable} -> {status}"
+        )
+        return status == "OK"
+
+    print(f"\n--- {requests} predictions, {workers} workers ---")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(model.predict, descriptions))
+    print(f"  threads took {(time.perf_counter() - start) * 1000:.1f} ms")
+    ok = check(results, "thread pool")
+
+    model_bytes = pickle.dumps(model)
+    chunks = [descriptions[i::workers] for i in range(workers)]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunk_results = list(
+            executor.map(_predict_batch, [model_bytes] * workers, chunks)
+        )
+    print(f"  processes took {(time.perf_counter() - start) * 1000:.1f} ms")
+    results = [None] * len(descriptions)
+    for i, chunk in enumerate(chunk_results):
+        results[i::workers] = chunk
+    ok = check(results, "process pool", frozen=False) and ok
+
+    ok = dict(model.response_template) == template_before and ok
+    if not ok:
+        raise SystemExit("Cross-request leakage detected.")
+    print("\n  No cross-request leakage.")
+
+
+def bench_neighbours(k: int, repeat: int):
+    """
+    Compares the nearest-neighbour model with the advanced model on the same
+    split used by train_and_evaluate: per-request latency and test metrics.
+    """
+    df = pd.read_csv(CSV_PATH)
+    df_train, df_test = train_test_split(df, train_size=0.8, random_state=42)
+
+    models = {}
+    for name, model in [
+        ("advanced", AdvancedPredictionModel()),
+        ("neighbours", NeighboursPredictionModel(k=k)),
+    ]:
+        start = time.perf_counter()
+        models[name] = model.learn(df_train)
+        print(f"  {name} fitted in {time.perf_counter() - start:.2f} s")
+
+    descriptions = df_test["description"].dropna().tolist()
+    sample = [descriptions[i % len(descriptions)] for i in range(repeat)]
+
+    print(f"\n--- Latency, {repeat} predictions ---")
+    for name, model in models.items():
+        print_timings(name, time_calls_over(model.predict, sample))
+
+    print("\n--- Test set metrics ---")
+    scores = {name: score_model(model, df_test) for name, model in models.items()}
+    rows = []
+    for target, (metric, _) in scores["advanced"].items():
+        rows.append({
+            "Target": target,
+            "Metric": metric,
+            **{name: round(scores[name][target][1], 4) for name in models},
+        })
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+def bench_tiered(repeat: int):
+    """
+    Compares full and tiered inference of the advanced model: latency, how
+    often each field is answered by the cheap stage, and test metrics.
+    """
+    df = pd.read_csv(CSV_PATH)
+    df_train, df_test = train_test_split(df, train_size=0.8, random_state=42)
+    model = AdvancedPredictionModel().learn(df_train)
+
+    descriptions = df_test["description"].dropna().tolist()
+    sample = [descriptions[i % len(descriptions)] for i in range(repeat)]
+
+    print(f"\n--- Latency, {repeat} predictions ---")
+    print_timings("full", time_calls_over(model.predict, sample))
+    print_timings("tiered", time_calls_over(model.predict_tiered, sample))
+
+    cheap = Counter()
+    for description in descriptions:
+        for target in model.cheap_rules:
+            for pattern, value, _ in model.cheap_rules[target]:
+                if apply_keyword_rule(pattern, value, description) is not None:
+                    cheap[target] += 1
+                    break
+    print(f"\n--- Fields answered by the cheap stage ({len(descriptions)} descriptions) ---")
+    for target in model.heads:
+        print(f"  {target:<16} {cheap[target] / len(descriptions):.1%}")
+
+    print("\n--- Test set metrics ---")
+    full = score_model(model, df_test)
+    tiered = score_model(SimpleNamespace(predict=model.predict_tiered), df_test)
+    rows = [
+        {"Target": t, "Metric": m, "full": round(v, 4), "tiered": round(tiered[t][1], 4)}
+        for t, (m, v) in full.items()
+    ]
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+TRAINING_ONLY_MODULES = [
+    "pandas",
+    "scipy",
+    "sklearn",
+    "sklearn.model_selection",
+    "sklearn.metrics",
+    "training",
+]
+
+COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.load_models()
+loaded = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "load_ms": (loaded - imported) * 1000,
+    "modules": sorted(sys.modules),
+}))
+"""
+
+
+def parse_importtime(stderr: str) -> List[tuple]:
+    """Parses `python -X importtime` output into (cumulative_us, depth, module)."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(cumulative), depth, name.strip()))
+    return rows
+
+
+def bench_imports(module: str, top: int, repeat: int):
+    """
+    Import-time report for a serving worker (`python -X importtime`) and the
+    cold start of `import app` followed by loading the saved models.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+    )
+    rows = parse_importtime(result.stderr)
+    total = max(cumulative for cumulative, _, _ in rows)
+    top_level = sorted(
+        (row for row in rows if row[1] == 1), reverse=True
+    )[:top]
+
+    print(f"--- python -X importtime -c 'import {module}' ---")
+    print(f"  total: {total / 1000:.1f} ms")
+    for cumulative, _, name in top_level:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    imported = {name for _, _, name in rows}
+    print("\n  Training-only modules imported:")
+    for name in TRAINING_ONLY_MODULES:
+        print(f"    {name:<26} {'yes' if name in imported else 'no'}")
+
+    print(f"\n--- Cold start (import app + load_models), {repeat} runs ---")
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", COLD_START_SCRIPT],
+            capture_output=True, text=True, check=True,
+        )
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    print_timings("import app", [run["import_ms"] for run in runs])
+    print_timings("load_models", [run["load_ms"] for run in runs])
+    print_timings("total", [run["import_ms"] + run["load_ms"] for run in runs])
+    loaded = set(runs[-1]["modules"])
+    print("\n  Modules present after load_models:")
+    for name in TRAINING_ONLY_MODULES:
+        print(f"    {name:<26} {'yes' if name in loaded else 'no'}")
+
+
+INDEPENDENT_WORKER_SCRIPT = """
+import sys, time
+import app
+app.load_models()
+app.advanced_model.predict("warm up")
+print("ready", flush=True)
+time.sleep(3600)
+"""
+
+
+def bench_memory(workers: int, port: int):
+    """
+    Total memory of N workers that each load their own copy of the models,
+    compared with the serve.py supervisor (counted too) whose forked workers
+    share memory-mapped weights.
+    """
+    print(f"--- {workers} independent workers (own copy of the models) ---")
+    procs = [
+        subprocess.Popen(
+            [sys.executable, "-c", INDEPENDENT_WORKER_SCRIPT],
+            stdout=subprocess.PIPE, text=True,
+        )
+        for _ in range(workers)
+    ]
+    try:
+        for proc in procs:
+            proc.stdout.readline()
+        independent = report_memory([proc.pid for proc in procs])
+    finally:
+        for proc in procs:
+            proc.kill()
+            proc.wait()
+
+    print(f"\n--- serve.py supervisor with {workers} workers ---")
+    supervisor = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--port", str(port)],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/app/health")
+                break
+            except OSError:
+                if time.monotonic() > deadline or supervisor.poll() is not None:
+                    raise SystemExit("Supervisor did not start.")
+                time.sleep(0.5)
+        time.sleep(1)
+        with open(f"/proc/{supervisor.pid}/task/{supervisor.pid}/children") as f:
+            children = [int(pid) for pid in f.read().split()]
+        shared = report_memory([supervisor.pid] + children, "supervisor + workers")
+    finally:
+        supervisor.terminate()
+        supervisor.wait()
+
+    print(
+        f"\n  Total PSS: {independent['Pss'] / 1024:.1f} MB -> "
+        f"{shared['Pss'] / 1024:.1f} MB"
+    )
+
+
+DRIFT_ROUTES = ["baseline", "advanced", "tiered", "neighbours", "online", "ab_test"]
+
+
+def _drift_after(descriptions: List[str]) -> dict:
+    """Drift snapshot after sending every description to every predict route."""
+    service.drift_monitor.reset()
+
+    async def send_all():
+        for description in descriptions:
+            body = orjson.dumps({"description": description})
+            for route in DRIFT_ROUTES:
+                await call_asgi(service.app, f"/app/predict/{route}", body)
+
+    asyncio.run(send_all())
+    return service.drift_monitor.snapshot()
+
+
+def _worst_psi(psi: dict) -> str:
+    known = {name: value for name, value in psi.items() if value is not None}
+    if not known:
+        return "-"
+    name = max(known, key=known.get)
+    return f"{known[name]:.3f} ({name})"
+
+
+def bench_drift():
+    """
+    Checks the drift monitor on the test split of train_and_evaluate, which
+    the saved reference is built from: the reference is refitted on one half
+    and the other half, sent to every predict route, must not suggest
+    retraining, while the same descriptions with every word reversed (unseen
+    vocabulary) must.
+    """
+    service.load_models()
+    if service.drift_monitor.reference is None:
+        raise SystemExit(
+            f"No drift reference in {service.MODELS_PATH}. "
+            "Run `python training.py train` first."
+        )
+
+    df = pd.read_csv(CSV_PATH)
+    _, df_test = train_test_split(df, train_size=0.8, random_state=42)
+    df_reference, df_live = train_test_split(df_test, train_size=0.5, random_state=0)
+    served = served_predictors(
+        service.base_model, service.advanced_model, service.neighbours_model, service.online_model
+    )
+    fit_drift_reference(
+        service.drift_monitor, service.advanced_model, served, df_reference,
+        learning=service.drift_monitor.learning_models,
+    )
+    held_out = df_live["description"].dropna().tolist()
+    shifted = [" ".join(word[::-1] for word in text.split()) for text in held_out]
+
+    log_file = service.PREDICTION_LOG_FILE
+    with tempfile.TemporaryDirectory() as log_dir:
+        service.PREDICTION_LOG_FILE = os.path.join(log_dir, "predictions.jsonl")
+        try:
+            snapshots = {"held-out": _drift_after(held_out), "shifted": _drift_after(shifted)}
+        finally:
+            service.PREDICTION_LOG_FILE = log_file
+
+    for scenario, snapshot in snapshots.items():
+        print(f"\n--- {scenario}: {len(held_out)} descriptions x {len(DRIFT_ROUTES)} routes ---")
+        sketches = {"inputs": snapshot["inputs"], **snapshot["models"]}
+        rows = [
+            {
+                "Sketch": name,
+                "Requests": sketch["live"]["requests"],
+                "Worst PSI": _worst_psi(sketch["psi"]),
+                "Retrain": sketch["retrain_suggested"],
+            }
+            for name, sketch in sketches.items()
+        ]
+        print(pd.DataFrame(rows).to_string(index=False))
+
+    if snapshots["held-out"]["retrain_suggested"]:
+        raise SystemExit("FAIL: the held-out split suggests retraining.")
+    if not snapshots["shifted"]["retrain_suggested"]:
+        raise SystemExit("FAIL: shifted traffic does not suggest retraining.")
+    print("\nOK: held-out traffic is stable on every route, shifted traffic is flagged.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the offer service.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    response_parser = subparsers.add_parser(
+        "response", help="Per-request framework overhead of the response path."
+    )
+    response_parser.add_argument("--repeat", type=int, default=2000)
+
+    concurrency_parser = subparsers.add_parser(
+        "concurrency", help="Stress test for cross-request leakage in predict()."
+    )
+    concurrency_parser.add_argument("--requests", type=int, default=5000)
+    concurrency_parser.add_argument("--workers", type=int, default=16)
+
+    neighbours_parser = subparsers.add_parser(
+        "neighbours", help="Nearest-neighbour model vs advanced model."
+    )
+    neighbours_parser.add_argument("--k", type=int, default=10)
+    neighbours_parser.add_argument("--repeat", type=int, default=500)
+
+    tiered_parser = subparsers.add_parser(
+        "tiered", help="Full vs tiered inference of the advanced model."
+    )
+    tiered_parser.add_argument("--repeat", type=int, default=500)
+
+    imports_parser = subparsers.add_parser(
+        "imports", help="Import-time and cold-start report for serving workers."
+    )
+    imports_parser.add_argument("--module", default="app")
+    imports_parser.add_argument("--top", type=int, default=10)
+    imports_parser.add_argument("--repeat", type=int, default=5)
+
+    memory_parser = subparsers.add_parser(
+        "memory", help="Worker memory: independent processes vs serve.py."
+    )
+    memory_parser.add_argument("--workers", type=int, default=4)
+    memory_parser.add_argument("--port", type=int, default=8099)
+
+    subparsers.add_parser(
+        "drift", help="Held-out split vs shifted traffic through the drift monitor."
+    )
+
+    args = parser.parse_args()
+    if args.command == "response":
+        bench_response(args.repeat)
+    elif args.command == "concurrency":
+        bench_concurrency(args.requests, args.workers)
+    elif args.command == "neighbours":
+        bench_neighbours(args.k, args.repeat)
+    elif args.command == "tiered":
+        bench_tiered(args.repeat)
+    elif args.command == "imports":
+        bench_imports(args.module, args.top, args.repeat)
+    elif args.command == "memory":
+        bench_memory(args.workers, args.port)
+    elif args.command == "drift":
+        bench_drift()
+
+
+if __name__ == "__main__":
+    main()
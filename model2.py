@@ -1,58 +1,342 @@
+from __future__ import annotations
+
+import copy
+import os
 import re
-import joblib
 import json
+import time
 import ast
-import pandas as pd
+import zlib
+from functools import lru_cache
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any, Mapping
+
 import numpy as np
-from sklearn.base import BaseEstimator, TransformerMixin
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.linear_model import LogisticRegression, Ridge
-from sklearn.pipeline import Pipeline
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_absolute_error, accuracy_score
 
-def extract_amenities_from_description(description: str):
-    regex_map = {}
-    with open("amenity_patterns.json") as file:
+# Only what inference needs is imported here, so serving workers start fast.
+# pandas, scipy and scikit-learn are imported inside the training methods.
+# learn() compiles the fitted estimators into the numpy-only TfidfFeatures,
+# LinearHead and CompressedRows below, so unpickling a trained model for
+# serving imports none of them.
+if TYPE_CHECKING:
+    import pandas as pd
+
+@lru_cache(maxsize=None)
+def load_amenity_patterns(path: str = "amenity_patterns.json"):
+    with open(path) as file:
         regex_map = json.load(file)
     if len(regex_map) == 0:
         raise Exception("Loaded 0 regex patterns.")
-    
-    compiled_patterns = {key: re.compile(pattern) for key, pattern in regex_map.items()}
-    found_amenities = set()
-    
-    for category, pattern in compiled_patterns.items():
-        if category not in found_amenities:
-            if pattern.search(description):
-                found_amenities.add(category)
-            
-    return sorted(list(found_amenities))
-
-class TextCleaner(BaseEstimator, TransformerMixin):
+
+    return tuple((key, re.compile(pattern)) for key, pattern in regex_map.items())
+
+def dump_atomic(obj, path: str):
+    """
+    joblib.dump to a temporary file renamed over path, so a reader never sees
+    a half-written artifact and processes that memory-mapped the old file
+    keep their (now unlinked) copy intact.
+    """
+    import joblib
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        joblib.dump(obj, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def freeze_prediction(predictions: dict) -> Mapping[str, Any]:
+    """
+    Read-only view of one request's result: amenities become a tuple and the
+    confidences a read-only mapping, so nothing can be changed after predict().
+    """
+    predictions["amenities"] = tuple(predictions.get("amenities") or ())
+    if "confidence" in predictions:
+        predictions["confidence"] = MappingProxyType(predictions["confidence"])
+    return MappingProxyType(predictions)
+
+def extract_amenities_from_description(description: str):
+    return sorted(
+        category
+        for category, pattern in load_amenity_patterns()
+        if pattern.search(description)
+    )
+
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+}
+_NUMBER = r"(\d+|" + "|".join(NUMBER_WORDS) + r")"
+
+# Cheap keyword rules used by the tiered inference mode: target -> [(pattern, value)].
+# A value of None means "the number captured by the pattern".
+KEYWORD_RULES = {
+    "room_type": [
+        (re.compile(r"(?i)\bprivate room\b"), "Private room"),
+        (re.compile(r"(?i)\bshared room\b"), "Shared room"),
+        (re.compile(r"(?i)\b(?:entire|whole)\s+(?:apartment|flat|home|house|place)\b"), "Entire home/apt"),
+    ],
+    "bedrooms": [
+        (re.compile(rf"(?i)\b{_NUMBER}[\s-]*(?:bedrooms?|bdrms?)\b"), None),
+        (re.compile(r"(?i)\bstudio\b"), 0),
+    ],
+    "beds": [
+        (re.compile(rf"(?i)\b{_NUMBER}\s+(?:(?:single|double|queen|king|twin|sofa)\s+)?beds?\b"), None),
+    ],
+    "accommodates": [
+        (re.compile(rf"(?i)\bsleeps\s+(?:up\s+to\s+)?{_NUMBER}\b"), None),
+        (re.compile(rf"(?i)\baccommodates?\s+(?:up\s+to\s+)?{_NUMBER}\b"), None),
+        (re.compile(rf"(?i)\b(?:up\s+to|maximum\s+of)\s+{_NUMBER}\s+(?:guests|people|persons|adults)\b"), None),
+    ],
+}
+
+def apply_keyword_rule(pattern, value, description: str):
+    match = pattern.search(description)
+    if match is None:
+        return None
+    if value is not None:
+        return value
+    number = match.group(1).lower()
+    return NUMBER_WORDS.get(number) or int(number)
+
+WORD_TO_NUM = {
+    "one": "1", "two": "2", "three": "3", "four": "4",
+    "five": "5", "six": "6", "seven": "7", "eight": "8",
+    "nine": "9", "ten": "10", "studio": "0",
+}
+_WORD_TO_NUM_RE = re.compile(r"\b(" + "|".join(WORD_TO_NUM) + r")\b")
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9\s]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+class TextCleaner:
+    """Pipeline step normalising descriptions; accepts any iterable of texts."""
     def fit(self, X, y=None):
         return self
 
     def transform(self, X):
-        return X.apply(self._clean_text)
+        return [self._clean_text(text) for text in X]
 
     def _clean_text(self, text):
         if not isinstance(text, str):
             return ""
 
         text = text.lower()
-        word_to_num = {
-            "one": "1", "two": "2", "three": "3", "four": "4",
-            "five": "5", "six": "6", "seven": "7", "eight": "8",
-            "nine": "9", "ten": "10", "studio": "0",
-        }
+        text = _WORD_TO_NUM_RE.sub(lambda match: WORD_TO_NUM[match.group()], text)
+        text = _HTML_TAG_RE.sub(" ", text)
+        text = _NON_ALNUM_RE.sub("", text)
+        text = _WHITESPACE_RE.sub(" ", text).strip()
+        return text
 
-        for word, num in word_to_num.items():
-            text = re.sub(r"\b" + word + r"\b", num, text)
 
-        text = re.sub(r"<[^>]+>", " ", text)
-        text = re.sub(r"[^a-z0-9\s]", "", text)
-        text = re.sub(r"\s+", " ", text).strip()
-        return text
+class TextFeatures:
+    """
+    numpy-only replica of the scikit-learn word analyzer (lowercase, token
+    pattern, stop words, word n-grams). Subclasses turn the term counts of a
+    cleaned description into one sparse row (indices, values).
+    """
+    def __init__(self, token_pattern=r"(?u)\b\w+\b", ngram_range=(1, 1), stop_words=(), lowercase=True):
+        self.token_pattern = token_pattern
+        self.ngram_range = tuple(ngram_range)
+        self.stop_words = frozenset(stop_words)
+        self.lowercase = lowercase
+        self._token_re = re.compile(token_pattern)
+
+    @property
+    def analyzer_key(self):
+        """Features with equal keys produce the same analyze() output."""
+        return (self.token_pattern, self.ngram_range, self.stop_words, self.lowercase)
+
+    def analyze(self, text: str) -> dict:
+        if self.lowercase:
+            text = text.lower()
+        stop_words = self.stop_words
+        tokens = [token for token in self._token_re.findall(text) if token not in stop_words]
+
+        counts = {}
+        min_n, max_n = self.ngram_range
+        for n in range(min_n, max_n + 1):
+            for i in range(len(tokens) - n + 1):
+                term = tokens[i] if n == 1 else " ".join(tokens[i:i + n])
+                counts[term] = counts.get(term, 0) + 1
+        return counts
+
+    def transform_counts(self, counts: dict):
+        raise NotImplementedError("Subclasses must implement transform_counts method.")
+
+    def transform(self, text: str):
+        return self.transform_counts(self.analyze(text))
+
+    @staticmethod
+    def _normalize(values):
+        norm = np.sqrt(values @ values)
+        if norm > 0:
+            values /= norm
+        return values
+
+
+class TfidfFeatures(TextFeatures):
+    """A fitted TfidfVectorizer (l2 norm) as a vocabulary dict and an idf array."""
+    # TfidfVectorizer settings the replica reproduces only with these values.
+    REQUIRED_SETTINGS = {
+        "analyzer": "word",
+        "preprocessor": None,
+        "tokenizer": None,
+        "strip_accents": None,
+        "binary": False,
+        "use_idf": True,
+        "norm": "l2",
+    }
+
+    def __init__(self, vocabulary, idf, sublinear_tf=False, **analyzer):
+        super().__init__(**analyzer)
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.sublinear_tf = sublinear_tf
+
+    @classmethod
+    def check_supported(cls, vectorizer):
+        """Raises ValueError for vectorizer settings the replica would not reproduce."""
+        unsupported = [
+            f"{name}={getattr(vectorizer, name)!r}"
+            for name, required in cls.REQUIRED_SETTINGS.items()
+            if getattr(vectorizer, name) != required
+        ]
+        if unsupported:
+            raise ValueError(f"TfidfFeatures cannot reproduce TfidfVectorizer({', '.join(unsupported)}).")
+
+    @classmethod
+    def from_vectorizer(cls, vectorizer, sample_texts=()):
+        """
+        Replica of a fitted vectorizer. Rows for `sample_texts` (cleaned
+        descriptions) are checked against vectorizer.transform().
+        """
+        cls.check_supported(vectorizer)
+        features = cls(
+            vocabulary={term: int(index) for term, index in vectorizer.vocabulary_.items()},
+            idf=np.asarray(vectorizer.idf_),
+            sublinear_tf=vectorizer.sublinear_tf,
+            token_pattern=vectorizer.token_pattern,
+            ngram_range=vectorizer.ngram_range,
+            stop_words=vectorizer.get_stop_words() or (),
+            lowercase=vectorizer.lowercase,
+        )
+        sample_texts = list(sample_texts)
+        for text, expected in zip(sample_texts, vectorizer.transform(sample_texts)):
+            indices, values = features.transform(text)
+            order = np.argsort(indices)
+            expected.sort_indices()
+            if not (
+                np.array_equal(indices[order], expected.indices)
+                and np.allclose(values[order], expected.data, rtol=1e-4, atol=1e-6)
+            ):
+                raise ValueError(f"TfidfFeatures does not reproduce the vectorizer on {text[:50]!r}.")
+        return features
+
+    def transform_counts(self, counts: dict):
+        vocabulary = self.vocabulary
+        indices, tf = [], []
+        for term, count in counts.items():
+            index = vocabulary.get(term)
+            if index is not None:
+                indices.append(index)
+                tf.append(count)
+
+        indices = np.array(indices, dtype=np.intp)
+        values = np.array(tf, dtype=self.idf.dtype)
+        if self.sublinear_tf:
+            values = np.log(values) + 1
+        values *= self.idf[indices]
+        return indices, self._normalize(values)
+
+
+class HashedFeatures(TextFeatures):
+    """
+    Stateless features: every term is hashed (CRC32) into one of n_features
+    columns, so new vocabulary needs no refit. Rows are l2-normalised.
+    """
+    def __init__(self, n_features=2 ** 16, **analyzer):
+        super().__init__(**analyzer)
+        self.n_features = n_features
+
+    def transform_counts(self, counts: dict):
+        columns = {}
+        for term, count in counts.items():
+            column = zlib.crc32(term.encode()) % self.n_features
+            columns[column] = columns.get(column, 0) + count
+
+        indices = np.fromiter(columns.keys(), dtype=np.intp, count=len(columns))
+        values = np.fromiter(columns.values(), dtype=np.float64, count=len(columns))
+        return indices, self._normalize(values)
+
+
+class LinearHead:
+    """
+    Weights of a fitted linear model (LogisticRegression, Ridge, SGD*), scored
+    on one sparse row by reading only the coefficients of its features.
+    """
+    def __init__(self, coef, intercept, classes=None, multinomial=False):
+        self.coef = coef
+        self.intercept = intercept
+        self.classes = classes
+        self.multinomial = multinomial
+
+    @classmethod
+    def from_estimator(cls, estimator):
+        from sklearn.linear_model import LogisticRegression
+
+        classes = getattr(estimator, "classes_", None)
+        # LogisticRegression uses a softmax over more than two classes;
+        # SGDClassifier normalises one-vs-rest sigmoids.
+        multinomial = (
+            isinstance(estimator, LogisticRegression)
+            and classes is not None
+            and len(classes) > 2
+        )
+        return cls(np.asarray(estimator.coef_), np.asarray(estimator.intercept_), classes, multinomial)
+
+    def decision_function(self, indices, values):
+        return np.atleast_1d(self.coef[..., indices] @ values + self.intercept)
+
+    def predict_proba(self, indices, values):
+        scores = self.decision_function(indices, values)
+        if self.multinomial:
+            proba = np.exp(scores - scores.max())
+        else:
+            proba = 1.0 / (1.0 + np.exp(-scores))
+            if len(proba) == 1:
+                return np.array([1.0 - proba[0], proba[0]])
+        return proba / proba.sum()
+
+
+class CompressedRows:
+    """
+    Sparse matrix as CSR arrays with the one product inference needs, so
+    serving does not import scipy.
+    """
+    def __init__(self, indptr, indices, data, n_cols):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.n_cols = n_cols
+
+    @classmethod
+    def from_scipy(cls, matrix):
+        matrix = matrix.tocsr()
+        return cls(matrix.indptr, matrix.indices, matrix.data, matrix.shape[1])
+
+    def weighted_sum(self, rows, weights):
+        """Dense sum of weights[i] * row rows[i]."""
+        starts = self.indptr[rows]
+        lengths = self.indptr[np.asarray(rows) + 1] - starts
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.arange(lengths.sum()) + np.repeat(starts - offsets, lengths)
+        return np.bincount(
+            self.indices[positions],
+            weights=self.data[positions] * np.repeat(weights, lengths),
+            minlength=self.n_cols,
+        )
 
 
 class PredictionModel:
@@ -62,43 +346,80 @@ class PredictionModel:
     def learn(self, df_train: pd.DataFrame):
         raise NotImplementedError("Subclasses must implement learn method.")
 
-    def predict(self, description: str) -> dict[str, str]:
+    def predict(self, description: str) -> Mapping[str, Any]:
         raise NotImplementedError("Subclasses must implement predict method.")
 
 
 class BasePredictionModel(PredictionModel):
+    """
+    Predicts the training-set mode/median for every field.
+    The statistics are compiled into a read-only response template at learn()
+    time, so predict() only merges the amenities found in the description and
+    never writes to shared state.
+    """
     def __init__(self):
         self.stats = {}
+        self.response_template = MappingProxyType({})
 
     def learn(self, df_train: pd.DataFrame):
         print(f"  [BaseModel] Learning naive statistics from {len(df_train)} rows...")
-        
+        stats = {}
+
         for target in self.TARGETS_CLASS:
             if target in df_train.columns:
                 valid = df_train[target].dropna()
                 if not valid.empty:
-                    self.stats[target] = valid.mode()[0]
+                    stats[target] = valid.mode()[0]
                 else:
-                    self.stats[target] = "Unknown"
+                    stats[target] = "Unknown"
 
         for target in self.TARGETS_REG:
             if target in df_train.columns:
                 valid = df_train[target].dropna()
                 if not valid.empty:
-                    self.stats[target] = int(valid.median())
+                    stats[target] = int(valid.median())
                 else:
-                    self.stats[target] = 0
+                    stats[target] = 0
+
+        self.stats = stats
+        self._compile_template()
         return self
 
-    def predict(self, description: str) -> dict[str, str]:
-        self.stats["amenities"] = extract_amenities_from_description(description)
-        self.stats["model_version"] = "baseline"
-        return self.stats
+    def _compile_template(self):
+        self.response_template = MappingProxyType(
+            {**self.stats, "model_version": "baseline"}
+        )
+
+    def __getstate__(self):
+        # MappingProxyType cannot be pickled; it is rebuilt from stats on load.
+        state = self.__dict__.copy()
+        state.pop("response_template", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._compile_template()
+
+    def predict(self, description: str) -> Mapping[str, Any]:
+        result = dict(self.response_template)
+        result["amenities"] = extract_amenities_from_description(description)
+        return freeze_prediction(result)
 
 
 class AdvancedPredictionModel(PredictionModel):
-    def __init__(self):
-        self.pipelines = {}
+    """
+    One TF-IDF + linear model pipeline per target. learn() fits them with
+    scikit-learn and keeps only their compiled features and weights.
+    """
+    def __init__(self, rule_threshold=0.8, rule_min_support=10):
+        self.vectorizers = {}
+        self.heads = {}
+        self.cheap_rules = {}
+        # Per-target overrides found by tune_hyperparameters:
+        # {target: {"tfidf": {...}, "model": {...}}}
+        self.target_params = {}
+        self.rule_threshold = rule_threshold
+        self.rule_min_support = rule_min_support
         self.tfidf_params = {
             "max_features": 5000,
             "stop_words": "english",
@@ -114,10 +435,40 @@ class AdvancedPredictionModel(PredictionModel):
             self._train_pipeline(df_train, target, model_type='classification')
         for target in self.TARGETS_REG:
             self._train_pipeline(df_train, target, model_type='regression')
-        
+
+        self._learn_cheap_rules(df_train)
         return self
 
+    def _learn_cheap_rules(self, df):
+        """
+        Measures the precision of every keyword rule on the training data and
+        keeps the ones reliable enough to skip the TF-IDF heads.
+        """
+        self.cheap_rules = {}
+        for target, rules in KEYWORD_RULES.items():
+            if target not in df.columns:
+                continue
+            data = df.dropna(subset=[target, "description"])
+            kept = []
+            for pattern, value in rules:
+                hits = correct = 0
+                for description, y in zip(data["description"], data[target]):
+                    pred = apply_keyword_rule(pattern, value, description)
+                    if pred is not None:
+                        hits += 1
+                        correct += pred == y
+                precision = correct / hits if hits else 0.0
+                if hits >= self.rule_min_support and precision >= self.rule_threshold:
+                    kept.append((pattern, value, round(precision, 4)))
+            if kept:
+                self.cheap_rules[target] = kept
+                print(f"    Cheap rules for {target}: {len(kept)} kept")
+
     def _train_pipeline(self, df, target, model_type):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression, Ridge
+        from sklearn.pipeline import Pipeline
+
         data = df.dropna(subset=[target, "description"])
         if data.empty:
             print(f"    Warning: No data for {target}")
@@ -125,141 +476,384 @@ class AdvancedPredictionModel(PredictionModel):
 
         X = data["description"]
         y = data[target]
+        params = self.target_params.get(target, {})
 
         if model_type == 'classification':
-            clf = LogisticRegression(max_iter=2000, C=1.0, solver="lbfgs")
+            clf = LogisticRegression(max_iter=2000, solver="lbfgs", **{"C": 1.0, **params.get("model", {})})
         else:
-            clf = Ridge(alpha=1)
+            clf = Ridge(**{"alpha": 1, **params.get("model", {})})
 
+        vectorizer = TfidfVectorizer(**{**self.tfidf_params, **params.get("tfidf", {})})
+        TfidfFeatures.check_supported(vectorizer)
         pipeline = Pipeline([
             ("cleaner", TextCleaner()),
-            ("tfidf", TfidfVectorizer(**self.tfidf_params)),
+            ("tfidf", vectorizer),
             ("model", clf),
         ])
 
         pipeline.fit(X, y)
-        self.pipelines[target] = pipeline
-
-    def predict(self, description: str) -> dict[str, str]:
-        predictions = {}
-        input_data = pd.Series([description])
-
-        for target, pipeline in self.pipelines.items():
+        self.vectorizers[target] = TfidfFeatures.from_vectorizer(
+            vectorizer, TextCleaner().transform(X[:20])
+        )
+        self.heads[target] = LinearHead.from_estimator(pipeline.named_steps["model"])
+
+    def _predict_heads(self, description, targets, predictions, confidence):
+        """
+        Cleans the description once, and heads whose vectorizers share analyzer
+        settings (all of them unless tuned otherwise) share one tokenisation;
+        each head then only maps the term counts onto its own vocabulary.
+        """
+        text = TextCleaner()._clean_text(description)
+        term_counts = {}
+
+        for target in targets:
+            head = self.heads[target]
+            features = self.vectorizers[target]
             try:
-                pred = pipeline.predict(input_data)[0]
+                key = features.analyzer_key
+                if key not in term_counts:
+                    term_counts[key] = features.analyze(text)
+                indices, values = features.transform_counts(term_counts[key])
                 if target in self.TARGETS_REG:
-                    pred = int(round(pred))
-                
+                    pred = int(round(head.decision_function(indices, values)[0]))
+                else:
+                    proba = head.predict_proba(indices, values)
+                    best = proba.argmax()
+                    pred = head.classes[best]
+                    confidence[target] = round(float(proba[best]), 4)
+
                 predictions[target] = pred
             except Exception:
                 predictions[target] = None
-        
+
+    def predict(self, description: str) -> Mapping[str, Any]:
+        predictions = {}
+        confidence = {}
+        self._predict_heads(description, self.heads, predictions, confidence)
+
         predictions["amenities"] = extract_amenities_from_description(description)
+        predictions["confidence"] = confidence
         predictions["model_version"] = "advanced"
-        return predictions
+        return freeze_prediction(predictions)
 
-def calculate_jaccard(list1: list, list2: list) -> float:
-    s1 = set(list1) if isinstance(list1, list) else set()
-    s2 = set(list2) if isinstance(list2, list) else set()
+    def predict_tiered(self, description: str) -> Mapping[str, Any]:
+        """
+        Answers fields covered by a reliable keyword rule directly (confidence is
+        the rule's training precision) and runs the TF-IDF heads only for the rest.
+        """
+        predictions = {}
+        confidence = {}
 
-    if not s1 and not s2:
-        return 1.0
+        for target, rules in self.cheap_rules.items():
+            for pattern, value, precision in rules:
+                pred = apply_keyword_rule(pattern, value, description)
+                if pred is not None:
+                    predictions[target] = pred
+                    confidence[target] = precision
+                    break
 
-    intersection = len(s1.intersection(s2))
-    union = len(s1.union(s2))
-    return intersection / union if union > 0 else 0.0
+        remaining = [target for target in self.heads if target not in predictions]
+        self._predict_heads(description, remaining, predictions, confidence)
 
-def evaluate_models(base_model, adv_model, df_test):
-    print("\n--- Evaluation on Test Set ---")
-    
-    classification_targets = ['room_type', 'property_type', 'bathrooms_text']
-    regression_targets = ['bedrooms', 'beds', 'accommodates']
-    regex_targets = ['amenities']
-    
-    results = []
-    
-    for target in classification_targets + regression_targets + regex_targets:
-        if target not in df_test.columns:
-            print(f"Warning: Column {target} missing in test set.")
-            continue
-        
-        valid_test = df_test.dropna(subset=[target, "description"])
-        if valid_test.empty:
-            continue
-
-        if target == 'amenities':
-            metric_name = "Jaccard"
-            
-            def safe_parse_list(x):
-                if not isinstance(x, str):
-                    return x
-                try:
-                    return ast.literal_eval(x)
-                except (ValueError, SyntaxError):
-                    return []
-            
-            y_true = valid_test[target].apply(safe_parse_list)
-            
-            y_pred_base = valid_test["description"].apply(lambda x: base_model.predict(x).get(target, []))
-            y_pred_adv = valid_test["description"].apply(lambda x: adv_model.predict(x).get(target, []))
-            
-            score_base = np.mean([calculate_jaccard(p, t) for p, t in zip(y_pred_base, y_true)])
-            score_adv = np.mean([calculate_jaccard(p, t) for p, t in zip(y_pred_adv, y_true)])
-            
-            improvement = score_adv - score_base
-        else:
-            y_true = valid_test[target]
-            base_val = base_model.predict("")[target]
-            y_pred_base = [base_val] * len(valid_test)            
-            y_pred_adv = valid_test["description"].apply(lambda x: adv_model.predict(x).get(target, 0))
-
-            if target in regression_targets:
-                metric_name = "MAE"
-                score_base = mean_absolute_error(y_true, y_pred_base)
-                score_adv = mean_absolute_error(y_true, y_pred_adv)
-                improvement = score_base - score_adv 
+        predictions["amenities"] = extract_amenities_from_description(description)
+        predictions["confidence"] = confidence
+        predictions["model_version"] = "advanced_tiered"
+        return freeze_prediction(predictions)
+
+class NeighboursPredictionModel(PredictionModel):
+    """
+    Retrieves the k training listings whose descriptions are most similar to
+    the new one and votes/averages their field values.
+    The index holds the L2-normalised float32 TF-IDF rows transposed (one row
+    per term), so cosine similarity with a query sums only the rows of the
+    query's terms.
+    """
+    def __init__(self, k=10, amenity_threshold=0.4):
+        self.k = k
+        self.amenity_threshold = amenity_threshold
+        self.vectorizer = None
+        self.index = None
+        self.class_labels = {}
+        self.class_codes = {}
+        self.reg_values = {}
+        self.amenity_labels = np.array([], dtype=object)
+        self.amenity_matrix = None
+        self.tfidf_params = {
+            "max_features": 5000,
+            "stop_words": "english",
+            "ngram_range": (1, 2),
+            "token_pattern": r"(?u)\b\w+\b",
+            "min_df": 3,
+            "dtype": np.float32,
+        }
+
+    def learn(self, df_train: pd.DataFrame):
+        import pandas as pd
+        from scipy import sparse
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        data = df_train.dropna(subset=["description"])
+        print(f"  [NeighboursModel] Indexing {len(data)} listings...")
+
+        vectorizer = TfidfVectorizer(**self.tfidf_params)
+        TfidfFeatures.check_supported(vectorizer)
+        texts = TextCleaner().transform(data["description"])
+        self.index = CompressedRows.from_scipy(vectorizer.fit_transform(texts).T)
+        self.vectorizer = TfidfFeatures.from_vectorizer(vectorizer, texts[:20])
+
+        for target in self.TARGETS_CLASS:
+            if target in data.columns:
+                codes, labels = pd.factorize(data[target])
+                self.class_codes[target] = codes.astype(np.int16)
+                self.class_labels[target] = np.asarray(labels, dtype=object)
+
+        for target in self.TARGETS_REG:
+            if target in data.columns:
+                self.reg_values[target] = data[target].to_numpy(dtype=np.float32)
+
+        if "amenities" in data.columns:
+            amenities = data["amenities"].apply(safe_parse_list)
+            labels = sorted({a for row in amenities if isinstance(row, list) for a in row})
+            positions = {label: i for i, label in enumerate(labels)}
+            rows, cols = [], []
+            for row_idx, row in enumerate(amenities):
+                if isinstance(row, list):
+                    for amenity in set(row):
+                        rows.append(row_idx)
+                        cols.append(positions[amenity])
+            self.amenity_labels = np.asarray(labels, dtype=object)
+            self.amenity_matrix = CompressedRows.from_scipy(sparse.csr_matrix(
+                (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+                shape=(len(data), len(labels)),
+            ))
+        return self
+
+    def _neighbours(self, description: str):
+        indices, values = self.vectorizer.transform(TextCleaner()._clean_text(description))
+        similarities = self.index.weighted_sum(indices, values)
+
+        k = min(self.k, len(similarities))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        weights = similarities[top]
+        if weights.sum() <= 0:
+            # Nothing in common with the training set: fall back to all listings.
+            top = np.arange(len(similarities))
+            weights = np.ones(len(similarities), dtype=np.float32)
+        return top, weights
+
+    def predict(self, description: str) -> Mapping[str, Any]:
+        predictions = {}
+        top, weights = self._neighbours(description)
+
+        for target, codes in self.class_codes.items():
+            neighbour_codes = codes[top]
+            known = neighbour_codes >= 0
+            if known.any():
+                votes = np.bincount(
+                    neighbour_codes[known],
+                    weights=weights[known],
+                    minlength=len(self.class_labels[target]),
+                )
+                predictions[target] = self.class_labels[target][votes.argmax()]
             else:
-                metric_name = "Accuracy"
-                score_base = accuracy_score(y_true, y_pred_base)
-                score_adv = accuracy_score(y_true, y_pred_adv)
-                improvement = score_adv - score_base
-
-        results.append({
-            "Target": target,
-            "Metric": metric_name,
-            "Base model score": round(score_base, 4),
-            "Advanced model score": round(score_adv, 4),
-            "Improvement": round(improvement, 4),
-            "Status": "SUKCES" if improvement >= 0 else "PORAŻKA"
-        })
-
-    print(pd.DataFrame(results))
-                
-
-def train_and_evaluate(base_model, advanced_model, csv_path="listings1.csv", train_ratio=0.8, save_path="models.pkl"):
-    if not (0 < train_ratio < 1):
-        raise ValueError("train_ratio must be between 0 and 1")
-
-    print(f"1. Loading data from {csv_path}...")
-    try:
-        df = pd.read_csv(csv_path)
-    except FileNotFoundError:
-        print(f"Error: {csv_path} not found.")
-        return
+                predictions[target] = None
 
-    df.dropna(subset=["description"])
+        for target, values in self.reg_values.items():
+            neighbour_values = values[top]
+            known = ~np.isnan(neighbour_values)
+            if known.any() and weights[known].sum() > 0:
+                mean = np.average(neighbour_values[known], weights=weights[known])
+                predictions[target] = int(round(mean))
+            else:
+                predictions[target] = None
 
-    print(f"2. Splitting data (Train: {train_ratio:.0%}, Test: {1-train_ratio:.0%})...")
-    df_train, df_test = train_test_split(df, train_size=train_ratio, random_state=42)
+        amenities = set(extract_amenities_from_description(description))
+        if self.amenity_matrix is not None:
+            shares = self.amenity_matrix.weighted_sum(top, weights) / weights.sum()
+            amenities.update(self.amenity_labels[shares >= self.amenity_threshold])
+        predictions["amenities"] = sorted(amenities)
+        predictions["model_version"] = "neighbours"
+        return freeze_prediction(predictions)
+
+    def save(self, path: str):
+        dump_atomic(self, path)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode=None):
+        import joblib
+        return joblib.load(path, mmap_mode=mmap_mode)
+
+class OnlinePredictionModel(PredictionModel):
+    """
+    Incrementally trainable model: hashed TF-IDF-like features (stateless, so
+    new vocabulary needs no refit) feeding SGD heads that support partial_fit,
+    plus running amenity frequencies. Used by online.OnlineLearner to learn
+    from host feedback without retraining from the CSV.
+    The scikit-learn estimators are only needed to keep learning: predict()
+    reads their weights compiled into LinearHeads, and export() leaves the
+    estimators out of the copy that is served.
+    """
+    def __init__(self, n_features=2 ** 16, epochs=5, amenity_threshold=0.5, max_amenities=1000):
+        self.epochs = epochs
+        self.amenity_threshold = amenity_threshold
+        self.max_amenities = max_amenities
+        self.n_features = n_features
+        self.features = None
+        self.estimators = {}
+        self.heads = {}
+        self.amenity_counts = {}
+        self.amenity_rows = 0
+        self.popular_amenities = ()
+        self.version = 0
+        # Training run the versions descend from; a retrain starts a new one.
+        self.lineage = None
+        # Log positions this version has learned up to (set by OnlineLearner).
+        self.log_offsets = {}
 
-    base_model.learn(df_train)
-    advanced_model.learn(df_train)
+    def learn(self, df_train: pd.DataFrame):
+        from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+        from sklearn.linear_model import SGDClassifier, SGDRegressor
+
+        data = df_train.dropna(subset=["description"])
+        print(f"  [OnlineModel] Initial training on {len(data)} rows...")
+        self.lineage = time.time_ns()
+        self.version = 0
+        self.log_offsets = {}
+        self.features = HashedFeatures(
+            n_features=self.n_features,
+            stop_words=ENGLISH_STOP_WORDS,
+            ngram_range=(1, 2),
+            token_pattern=r"(?u)\b\w+\b",
+        )
 
-    artifacts = {
-        "base_model": base_model, 
-        "advanced_model": advanced_model
-    }
-    joblib.dump(artifacts, save_path)
-    print(f"\nModels saved to {save_path}")
+        for target in self.TARGETS_CLASS:
+            if target in data.columns and data[target].notna().any():
+                self.estimators[target] = SGDClassifier(loss="log_loss", alpha=1e-5, random_state=42)
+                self.estimators[target].classes_seen = np.unique(data[target].dropna().astype(str))
+        for target in self.TARGETS_REG:
+            if target in data.columns and data[target].notna().any():
+                self.estimators[target] = SGDRegressor(
+                    alpha=1e-5, learning_rate="constant", eta0=0.1, random_state=42
+                )
+
+        for epoch in range(self.epochs):
+            self.partial_fit(data.sample(frac=1, random_state=epoch), update_amenities=epoch == 0)
+        return self
 
-    evaluate_models(base_model, advanced_model, df_test)
\ No newline at end of file
+    def _feature_matrix(self, descriptions):
+        from scipy import sparse
+
+        rows = [self.features.transform(text) for text in TextCleaner().transform(descriptions)]
+        indptr = np.cumsum([0] + [len(indices) for indices, _ in rows])
+        return sparse.csr_matrix(
+            (
+                np.concatenate([values for _, values in rows]),
+                np.concatenate([indices for indices, _ in rows]),
+                indptr,
+            ),
+            shape=(len(rows), self.n_features),
+        )
+
+    def partial_fit(self, df: pd.DataFrame, update_amenities=True):
+        """
+        Updates every head with the rows of df that carry its target, and the
+        amenity frequencies. Labels unseen at learn() time are skipped.
+        """
+        data = df.dropna(subset=["description"])
+        if data.empty:
+            return self
+        X = self._feature_matrix(data["description"].tolist())
+
+        for target, estimator in self.estimators.items():
+            if target not in data.columns:
+                continue
+            y = data[target]
+            if target in self.TARGETS_CLASS:
+                mask = y.notna() & y.astype(str).isin(estimator.classes_seen)
+                if mask.any():
+                    estimator.partial_fit(
+                        X[mask.to_numpy()], y[mask].astype(str), classes=estimator.classes_seen
+                    )
+            else:
+                mask = y.notna()
+                if mask.any():
+                    estimator.partial_fit(X[mask.to_numpy()], y[mask].astype(float))
+
+        self._compile_heads()
+        if update_amenities and "amenities" in data.columns:
+            self._update_amenities(data["amenities"])
+        return self
+
+    def _compile_heads(self):
+        self.heads = {
+            target: LinearHead.from_estimator(estimator) if hasattr(estimator, "coef_") else None
+            for target, estimator in self.estimators.items()
+        }
+
+    def __getstate__(self):
+        # With the estimators present the heads only view their weights; they
+        # are recompiled on load instead of being saved twice.
+        state = self.__dict__.copy()
+        if self.estimators:
+            state.pop("heads", None)
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault("lineage", None)
+        self.__dict__.update(state)
+        if "heads" not in state:
+            self._compile_heads()
+
+    def _update_amenities(self, amenities):
+        for row in amenities.apply(safe_parse_list):
+            if not isinstance(row, list):
+                continue
+            self.amenity_rows += 1
+            for amenity in set(row):
+                if amenity in self.amenity_counts:
+                    self.amenity_counts[amenity] += 1
+                elif len(self.amenity_counts) < self.max_amenities:
+                    self.amenity_counts[amenity] = 1
+
+        min_count = self.amenity_threshold * self.amenity_rows
+        self.popular_amenities = tuple(
+            amenity for amenity, count in self.amenity_counts.items() if count >= min_count
+        )
+
+    def export(self) -> OnlinePredictionModel:
+        """Independent copy for serving, without the scikit-learn estimators."""
+        served = copy.copy(self)
+        served.estimators = {}
+        return copy.deepcopy(served)
+
+    def predict(self, description: str) -> Mapping[str, Any]:
+        predictions = {}
+        confidence = {}
+        indices, values = self.features.transform(TextCleaner()._clean_text(description))
+
+        for target, head in self.heads.items():
+            if head is None:
+                predictions[target] = None
+            elif target in self.TARGETS_CLASS:
+                proba = head.predict_proba(indices, values)
+                best = proba.argmax()
+                predictions[target] = head.classes[best]
+                confidence[target] = round(float(proba[best]), 4)
+            else:
+                score = head.decision_function(indices, values)[0]
+                predictions[target] = max(0, int(round(score)))
+
+        amenities = set(extract_amenities_from_description(description))
+        amenities.update(self.popular_amenities)
+        predictions["amenities"] = sorted(amenities)
+        predictions["confidence"] = confidence
+        predictions["model_version"] = f"online-v{self.version}"
+        return freeze_prediction(predictions)
+
+def safe_parse_list(x):
+    if not isinstance(x, str):
+        return x
+    try:
+        return ast.literal_eval(x)
+    except (ValueError, SyntaxError):
+        return []
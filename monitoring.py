@@ -0,0 +1,303 @@
+import copy
+import math
+import re
+import threading
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Mapping
+
+from model2 import PredictionModel, TextCleaner, load_amenity_patterns
+
+# Fixed bin edges keep every sketch at constant size regardless of traffic.
+LENGTH_EDGES = (50, 100, 200, 400, 600, 800, 1000, 1500)
+OOV_RATE_EDGES = (0.05, 0.1, 0.2, 0.3, 0.5)
+NUMBER_EDGES = (1, 2, 3, 4, 5, 6, 8, 10)
+TOKEN_PATTERN = re.compile(r"(?u)\b\w+\b")
+OTHER_CLASS = "<other>"
+
+
+def _bin_labels(edges) -> List[str]:
+    labels = [f"<{edges[0]}"]
+    labels += [f"{low}-{high}" for low, high in zip(edges, edges[1:])]
+    labels.append(f">={edges[-1]}")
+    return labels
+
+
+def population_stability_index(live: Dict[str, int], reference: Dict[str, int], smoothing=0.5):
+    """
+    PSI between two count distributions; None if either side is empty.
+    `smoothing` is added to every bin's count, so a rare bin seen on one side
+    only does not dominate the sum. Two samples of the same distribution
+    already differ by about (bins - 1) * (1 / n_live + 1 / n_reference); that
+    sampling bias is subtracted, so small samples over many bins do not look
+    drifted.
+    """
+    live_count = sum(live.values())
+    ref_count = sum(reference.values())
+    if not live_count or not ref_count:
+        return None
+
+    keys = set(live) | set(reference)
+    live_total = live_count + smoothing * len(keys)
+    ref_total = ref_count + smoothing * len(keys)
+    psi = 0.0
+    for key in keys:
+        p = (live.get(key, 0) + smoothing) / live_total
+        q = (reference.get(key, 0) + smoothing) / ref_total
+        psi += (p - q) * math.log(p / q)
+    bias = (len(keys) - 1) * (1 / live_count + 1 / ref_count)
+    return round(max(psi - bias, 0.0), 4)
+
+
+class DriftMonitor:
+    """
+    Constant-memory sketches of live traffic compared with the training data.
+    Input sketches (out-of-vocabulary token rate against the TF-IDF
+    vocabulary, description length histogram) are shared by every route;
+    prediction sketches (predicted value distributions per target, amenity
+    hit rates) are kept per model, since each model predicts differently on
+    the same input. observe() is a handful of counter increments per request.
+
+    Drift is summarised as the population stability index (PSI) of every
+    sketch against the reference built from held-out data the models did not
+    train on (predictions against that model's own reference); a PSI above
+    `psi_threshold` on enough requests suggests retraining. Models that keep
+    learning while serving are reported but never suggest retraining, since
+    their own updates move their predictions away from the reference.
+    """
+
+    def __init__(self, max_classes=50, psi_threshold=0.25, min_requests=100):
+        self.max_classes = max_classes
+        self.psi_threshold = psi_threshold
+        self.min_requests = min_requests
+        self.vocabulary = frozenset()
+        self.stop_words = frozenset()
+        self.reference = None
+        self.model_references = {}
+        self.learning_models = frozenset()
+        self._lock = threading.Lock()
+        self.live = self._empty_input_sketches()
+        self.live_models = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_lock", None)
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault("learning_models", frozenset())
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _empty_input_sketches() -> dict:
+        return {
+            "requests": 0,
+            "length_sum": 0,
+            "tokens": 0,
+            "oov_tokens": 0,
+            "length": [0] * (len(LENGTH_EDGES) + 1),
+            "oov_rate": [0] * (len(OOV_RATE_EDGES) + 1),
+        }
+
+    @staticmethod
+    def _empty_prediction_sketches() -> dict:
+        return {
+            "requests": 0,
+            "classes": {target: {} for target in PredictionModel.TARGETS_CLASS},
+            "numbers": {
+                target: [0] * (len(NUMBER_EDGES) + 1)
+                for target in PredictionModel.TARGETS_REG
+            },
+            "amenities": {name: 0 for name, _ in load_amenity_patterns()},
+        }
+
+    def reset(self):
+        with self._lock:
+            self.live = self._empty_input_sketches()
+            self.live_models = {}
+
+    def _tokenize(self, description: str):
+        text = TextCleaner()._clean_text(description)
+        return [t for t in TOKEN_PATTERN.findall(text) if t not in self.stop_words]
+
+    def _update_input(self, sketch: dict, description: str, tokens: List[str]):
+        oov = sum(token not in self.vocabulary for token in tokens) if self.vocabulary else 0
+
+        sketch["requests"] += 1
+        sketch["length_sum"] += len(description)
+        sketch["tokens"] += len(tokens)
+        sketch["oov_tokens"] += oov
+        sketch["length"][bisect_right(LENGTH_EDGES, len(description))] += 1
+        if tokens and self.vocabulary:
+            sketch["oov_rate"][bisect_right(OOV_RATE_EDGES, oov / len(tokens))] += 1
+
+    def _update_prediction(self, sketch: dict, prediction: Mapping):
+        sketch["requests"] += 1
+        for target, counts in sketch["classes"].items():
+            value = prediction.get(target)
+            if value is None:
+                continue
+            key = str(value)
+            if key not in counts and len(counts) >= self.max_classes:
+                key = OTHER_CLASS
+            counts[key] = counts.get(key, 0) + 1
+
+        for target, bins in sketch["numbers"].items():
+            value = prediction.get(target)
+            if value is not None:
+                bins[bisect_right(NUMBER_EDGES, value)] += 1
+
+        amenity_counts = sketch["amenities"]
+        for amenity in prediction.get("amenities") or ():
+            if amenity in amenity_counts:
+                amenity_counts[amenity] += 1
+
+    def observe(self, description: str, prediction: Mapping, model: str):
+        """
+        Adds one served request to the shared input sketches and to the
+        prediction sketches of the model that served it.
+        """
+        tokens = self._tokenize(description)
+        with self._lock:
+            self._update_input(self.live, description, tokens)
+            sketch = self.live_models.get(model)
+            if sketch is None:
+                sketch = self.live_models[model] = self._empty_prediction_sketches()
+            self._update_prediction(sketch, prediction)
+
+    def fit_reference(
+        self,
+        descriptions: List[str],
+        predictions: Dict[str, List[Mapping]],
+        vocabulary: Iterable[str] = (),
+        stop_words: Iterable[str] = (),
+        learning: Iterable[str] = (),
+    ):
+        """
+        Builds the reference sketches from held-out descriptions and, per
+        model name, that model's predictions for them (not the labels:
+        predicted distributions are narrower than the true ones and would
+        always look drifted). `learning` names the models that keep learning
+        online.
+        """
+        self.vocabulary = frozenset(vocabulary)
+        self.stop_words = frozenset(stop_words)
+        self.learning_models = frozenset(learning)
+        reference = self._empty_input_sketches()
+        for description in descriptions:
+            self._update_input(reference, description, self._tokenize(description))
+
+        model_references = {}
+        for model, model_predictions in predictions.items():
+            sketch = model_references[model] = self._empty_prediction_sketches()
+            for prediction in model_predictions:
+                self._update_prediction(sketch, prediction)
+
+        self.reference = reference
+        self.model_references = model_references
+        self.reset()
+        return self
+
+    @staticmethod
+    def _input_summary(sketch: dict) -> dict:
+        requests = sketch["requests"]
+        return {
+            "requests": requests,
+            "oov_token_rate": (
+                round(sketch["oov_tokens"] / sketch["tokens"], 4) if sketch["tokens"] else None
+            ),
+            "oov_rate_histogram": dict(zip(_bin_labels(OOV_RATE_EDGES), sketch["oov_rate"])),
+            "mean_length": round(sketch["length_sum"] / requests, 1) if requests else None,
+            "length_histogram": dict(zip(_bin_labels(LENGTH_EDGES), sketch["length"])),
+        }
+
+    @staticmethod
+    def _prediction_summary(sketch: dict) -> dict:
+        requests = sketch["requests"]
+        number_labels = _bin_labels(NUMBER_EDGES)
+        return {
+            "requests": requests,
+            "classes": {t: dict(counts) for t, counts in sketch["classes"].items()},
+            "numbers": {
+                t: dict(zip(number_labels, bins)) for t, bins in sketch["numbers"].items()
+            },
+            "amenity_hit_rates": {
+                name: round(count / requests, 4) if requests else None
+                for name, count in sketch["amenities"].items()
+            },
+        }
+
+    def _drifted(self, requests: int, psi: dict) -> bool:
+        return requests >= self.min_requests and any(
+            value is not None and value > self.psi_threshold for value in psi.values()
+        )
+
+    def _model_snapshot(self, live_sketch: dict, reference_sketch: dict, learning: bool) -> dict:
+        live = self._prediction_summary(live_sketch)
+        result = {
+            "live": live,
+            "reference": None,
+            "psi": {},
+            "learning": learning,
+            "retrain_suggested": False,
+        }
+        if reference_sketch is None:
+            return result
+
+        reference = self._prediction_summary(reference_sketch)
+        psi = {}
+        for target in live["classes"]:
+            psi[target] = population_stability_index(
+                live["classes"][target], reference["classes"][target]
+            )
+        for target in live["numbers"]:
+            psi[target] = population_stability_index(
+                live["numbers"][target], reference["numbers"][target]
+            )
+        psi["amenities"] = population_stability_index(
+            live_sketch["amenities"], reference_sketch["amenities"]
+        )
+
+        result["reference"] = reference
+        result["psi"] = psi
+        result["retrain_suggested"] = not learning and self._drifted(live["requests"], psi)
+        return result
+
+    def snapshot(self) -> dict:
+        """
+        Live and reference summaries of the inputs and of each model's
+        predictions, plus a PSI per sketch.
+        """
+        with self._lock:
+            live_sketch = copy.deepcopy(self.live)
+            live_models = copy.deepcopy(self.live_models)
+
+        live = self._input_summary(live_sketch)
+        inputs = {"live": live, "reference": None, "psi": {}, "retrain_suggested": False}
+        if self.reference is not None:
+            reference = self._input_summary(self.reference)
+            psi = {
+                "length": population_stability_index(
+                    live["length_histogram"], reference["length_histogram"]
+                ),
+                "oov_rate": population_stability_index(
+                    live["oov_rate_histogram"], reference["oov_rate_histogram"]
+                ),
+            }
+            inputs["reference"] = reference
+            inputs["psi"] = psi
+            inputs["retrain_suggested"] = self._drifted(live["requests"], psi)
+
+        models = {
+            model: self._model_snapshot(
+                sketch, self.model_references.get(model), model in self.learning_models
+            )
+            for model, sketch in live_models.items()
+        }
+        return {
+            "inputs": inputs,
+            "models": models,
+            "retrain_suggested": inputs["retrain_suggested"] or any(
+                model["retrain_suggested"] for model in models.values()
+            ),
+        }
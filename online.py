@@ -0,0 +1,318 @@
+import copy
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from model2 import OnlinePredictionModel, dump_atomic
+
+
+class OnlineLearner:
+    """
+    Background worker that keeps an OnlinePredictionModel learning from host
+    feedback.
+
+    It tails the prediction log (for the original descriptions) and the
+    feedback log, joins them on prediction_id, and feeds the joined records to
+    a private training copy of the model in micro-batches. A batch is trained
+    once it is full or `flush_after` seconds after its first record. Every
+    `publish_every` batches a snapshot of that copy becomes the served model,
+    so the request path only ever reads `self.model` and never waits for
+    training. Memory is bounded by `max_pending` unmatched predictions, one
+    micro-batch and one `chunk_size` read of a log.
+
+    Each publish writes the served model (without scikit-learn estimators) to
+    `save_path` and the full training copy to `state_path`, both recording the
+    log offsets learned up to, so a restarted learner resumes there instead of
+    training on old feedback again. Only one process learns at a time (a lock
+    file next to `save_path`); the others follow by reloading each version it
+    publishes.
+
+    Retraining from the CSV starts a new lineage at version 0. Followers load
+    it because the lineage changed; the learning process notices that
+    `state_path` was replaced and continues from the retrained state instead
+    of publishing over it.
+    """
+
+    def __init__(
+        self,
+        model: OnlinePredictionModel,
+        prediction_log: str,
+        feedback_log: str,
+        batch_size: int = 32,
+        publish_every: int = 1,
+        poll_interval: float = 5.0,
+        flush_after: float = 60.0,
+        max_pending: int = 10000,
+        chunk_size: int = 1 << 20,
+        save_path: Optional[str] = "online_model.pkl",
+        state_path: Optional[str] = "online_state.pkl",
+    ):
+        self.model = model
+        self.prediction_log = prediction_log
+        self.feedback_log = feedback_log
+        self.batch_size = batch_size
+        self.publish_every = publish_every
+        self.poll_interval = poll_interval
+        self.flush_after = flush_after
+        self.max_pending = max_pending
+        self.chunk_size = chunk_size
+        self.save_path = save_path
+        self.state_path = state_path
+        self.leader = None
+
+        self._training_model = None
+        # prediction_id -> (description, offset of its line in the prediction log)
+        self._pending = OrderedDict()
+        # [(record, offset of its prediction line, end offset of its feedback line)]
+        self._batch = []
+        self._batch_started = None
+        self._batches_since_publish = 0
+        self._offsets = {}
+        self._trained_feedback_offset = 0
+        self._lock_file = None
+        self._state_signature = None
+        self._loaded_mtime = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"joined": 0, "unmatched": 0, "batches": 0, "published": 0}
+
+    def start(self):
+        if self._thread is None:
+            self.leader = self._acquire_lock() and self._load_training_model()
+            if self.leader:
+                target, name = self._run, "online-learner"
+            else:
+                print("[OnlineLearner] Another process is learning; following its versions.")
+                self._loaded_mtime = self._saved_mtime()
+                target, name = self._follow, "online-follower"
+            self._thread = threading.Thread(target=target, name=name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _acquire_lock(self) -> bool:
+        if not self.save_path:
+            return True
+        import fcntl
+
+        lock_file = open(f"{self.save_path}.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _state_file_signature(self):
+        if not self.state_path:
+            return None
+        try:
+            stat = os.stat(self.state_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _state_replaced(self) -> bool:
+        """Whether another process (a retrain) wrote state_path since we did."""
+        signature = self._state_file_signature()
+        return signature is not None and signature != self._state_signature
+
+    def _load_training_model(self) -> bool:
+        """
+        The copy to train: the served model if it still has its estimators
+        (trained in this process), otherwise the saved learner state. A state
+        replaced by a retrain is loaded again, dropping what was read from the
+        logs for the old lineage.
+        """
+        if self._training_model is not None and not self._state_replaced():
+            return True
+        if self._training_model is None and self.model.estimators:
+            model = copy.deepcopy(self.model)
+        elif self.state_path and os.path.exists(self.state_path):
+            import joblib
+            if self._training_model is not None:
+                print(f"[OnlineLearner] {self.state_path} was replaced; reloading it.")
+            model = joblib.load(self.state_path)
+        else:
+            print(f"[OnlineLearner] No learner state in {self.state_path}; not learning.")
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+            return False
+
+        self._training_model = model
+        self._state_signature = self._state_file_signature()
+        if model.lineage != self.model.lineage:
+            self.model = model.export()
+            print(f"[OnlineLearner] Serving lineage {model.lineage}, online-v{model.version}")
+        self._pending.clear()
+        self._batch = []
+        self._batches_since_publish = 0
+        self._offsets = {
+            self.prediction_log: model.log_offsets.get("predictions", 0),
+            self.feedback_log: model.log_offsets.get("feedback", 0),
+        }
+        self._trained_feedback_offset = self._offsets[self.feedback_log]
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"[OnlineLearner] Update failed: {e}")
+
+    def _follow(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.reload()
+            except Exception as e:
+                print(f"[OnlineLearner] Reload failed: {e}")
+
+    def _saved_mtime(self):
+        try:
+            return os.stat(self.save_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def reload(self):
+        """
+        Serves the latest version published by the learning process, or the
+        first version of a new lineage after a retrain.
+        """
+        mtime = self._saved_mtime()
+        if mtime is None or mtime == self._loaded_mtime:
+            return
+        import joblib
+
+        model = joblib.load(self.save_path)
+        self._loaded_mtime = mtime
+        if model.lineage != self.model.lineage or model.version > self.model.version:
+            self.model = model
+            print(f"[OnlineLearner] Loaded lineage {model.lineage}, online-v{model.version}")
+
+    def _read_new_lines(self, path: str):
+        """
+        Yields (entry, start, end) for complete JSON lines appended to path
+        since the last call, where start and end are the line's byte offsets.
+        The log is read `chunk_size` bytes at a time; a line longer than that
+        is skipped.
+        """
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return
+
+        with f:
+            f.seek(self._offsets[path])
+            skipping = False
+            while True:
+                data = f.read(self.chunk_size)
+                # A line without its trailing newline is still being written.
+                end = data.rfind(b"\n") + 1
+                if not end:
+                    if len(data) < self.chunk_size:
+                        return
+                    if not skipping:
+                        print(f"[OnlineLearner] Skipping a line over {self.chunk_size} bytes in {path}")
+                        skipping = True
+                    self._offsets[path] += len(data)
+                    continue
+
+                start = self._offsets[path]
+                for line in data[:end].splitlines(keepends=True):
+                    line_start, start = start, start + len(line)
+                    if skipping:
+                        skipping = False
+                    elif line.strip():
+                        yield json.loads(line), line_start, start
+                    self._offsets[path] = start
+                f.seek(self._offsets[path])
+
+    def poll(self):
+        """
+        Consumes newly logged predictions and feedback; trains full batches and
+        batches older than flush_after.
+        """
+        if not self._load_training_model():
+            return
+        for entry, start, _ in self._read_new_lines(self.prediction_log):
+            if "description" not in entry:
+                continue
+            self._pending[entry["prediction_id"]] = (entry["description"], start)
+            if len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+
+        for feedback, _, end in self._read_new_lines(self.feedback_log):
+            pending = self._pending.pop(feedback.get("prediction_id"), None)
+            if pending is None:
+                self.stats["unmatched"] += 1
+                continue
+            description, prediction_offset = pending
+            if not self._batch:
+                self._batch_started = time.monotonic()
+            self._batch.append(({**feedback, "description": description}, prediction_offset, end))
+            self.stats["joined"] += 1
+
+            if len(self._batch) >= self.batch_size:
+                self._train_batch()
+
+        if self._batch and time.monotonic() - self._batch_started >= self.flush_after:
+            self._train_batch()
+
+    def _train_batch(self):
+        import pandas as pd
+
+        batch, self._batch = self._batch, []
+        self._training_model.partial_fit(pd.DataFrame([record for record, _, _ in batch]))
+        self._trained_feedback_offset = batch[-1][2]
+        self.stats["batches"] += 1
+        self._batches_since_publish += 1
+
+        if self._batches_since_publish >= self.publish_every:
+            self.publish()
+
+    def _resume_offsets(self) -> dict:
+        """
+        Log offsets a restarted learner continues from: feedback after the
+        last trained record, and predictions from the oldest one that may
+        still be joined with feedback read after that point.
+        """
+        prediction_offset = self._offsets[self.prediction_log]
+        waiting = [offset for _, offset, _ in self._batch]
+        if self._pending:
+            waiting.append(next(iter(self._pending.values()))[1])
+        return {
+            "predictions": min([prediction_offset] + waiting),
+            "feedback": self._trained_feedback_offset,
+        }
+
+    def publish(self):
+        if self._state_replaced():
+            # A retrain replaced the state while this batch trained; the next
+            # poll continues from the retrained model instead.
+            print("[OnlineLearner] Learner state was replaced; not publishing over it.")
+            return
+        self._training_model.version += 1
+        self._training_model.log_offsets = self._resume_offsets()
+        snapshot = self._training_model.export()
+        if self.state_path:
+            dump_atomic(self._training_model, self.state_path)
+            self._state_signature = self._state_file_signature()
+        if self.save_path:
+            dump_atomic(snapshot, self.save_path)
+        self.model = snapshot
+        self._batches_since_publish = 0
+        self.stats["published"] += 1
+        print(f"[OnlineLearner] Published online-v{snapshot.version}")
@@ -0,0 +1,173 @@
+import argparse
+import gc
+import os
+import signal
+import socket
+import time
+from typing import Dict, List
+
+import app as service
+
+MEMORY_FIELDS = ["Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty"]
+WARMUP_DESCRIPTION = "Cozy apartment in the city center with 2 bedrooms and wifi."
+
+
+def read_memory(pid: int) -> Dict[str, int]:
+    """
+    Memory of a process in kB from /proc/<pid>/smaps_rollup.
+    Pss splits shared pages between the processes mapping them, so the sum of
+    Pss over workers is the real memory cost of the pool.
+    """
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in MEMORY_FIELDS:
+                values[key] = int(rest.split()[0])
+    return values
+
+
+def report_memory(pids: List[int], label: str = "workers"):
+    print(f"\n--- Memory of {label} (MB) ---")
+    print(f"  {'pid':>8} {'rss':>8} {'pss':>8} {'shared':>8} {'private':>8}")
+    totals = {"Rss": 0, "Pss": 0}
+    for pid in pids:
+        try:
+            mem = read_memory(pid)
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+        shared = mem["Shared_Clean"] + mem["Shared_Dirty"]
+        private = mem["Private_Clean"] + mem["Private_Dirty"]
+        totals["Rss"] += mem["Rss"]
+        totals["Pss"] += mem["Pss"]
+        print(
+            f"  {pid:>8} {mem['Rss'] / 1024:8.1f} {mem['Pss'] / 1024:8.1f} "
+            f"{shared / 1024:8.1f} {private / 1024:8.1f}"
+        )
+    print(
+        f"  {'total':>8} {totals['Rss'] / 1024:8.1f} {totals['Pss'] / 1024:8.1f}"
+    )
+    return totals
+
+
+def load_shared_models():
+    """
+    Loads every saved model once, with weight arrays memory-mapped read-only,
+    and runs one prediction per model so lazily imported modules are loaded
+    before forking.
+    The writers replace the files instead of rewriting them, so the mapped
+    pages stay valid; new weights are only served after a restart.
+    """
+    service.load_models(mmap_mode="r")
+    if not service.advanced_model.heads:
+        raise SystemExit(
+            f"No trained models in {service.MODELS_PATH}. "
+            "Run `python training.py train` first."
+        )
+
+    service.base_model.predict(WARMUP_DESCRIPTION)
+    service.advanced_model.predict(WARMUP_DESCRIPTION)
+    if service.neighbours_model.index is not None:
+        service.neighbours_model.predict(WARMUP_DESCRIPTION)
+    if service.online_model.heads:
+        service.online_model.predict(WARMUP_DESCRIPTION)
+
+
+def run_worker(sock: socket.socket):
+    import uvicorn
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    config = uvicorn.Config(service.app, log_level="warning")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pre-fork supervisor: loads the models once into "
+        "memory-mapped read-only arrays and forks workers sharing them. "
+        "Restart it to serve models saved after it started."
+    )
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--report-interval",
+        type=float,
+        default=0,
+        help="Seconds between memory reports (0 reports once after startup).",
+    )
+    args = parser.parse_args()
+
+    print(f"Loading models from {service.MODELS_PATH} (memory-mapped)...")
+    load_shared_models()
+    # Workers learning online would each train their own copy; they only serve.
+    service.ONLINE_LEARNING = False
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    # Keep the garbage collector from touching (and so copying) the pages of
+    # objects loaded before the fork.
+    gc.freeze()
+
+    def fork_worker() -> int:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(sock)
+            finally:
+                os._exit(0)
+        return pid
+
+    alive = {fork_worker() for _ in range(args.workers)}
+    print(f"Started {len(alive)} workers on {args.host}:{args.port}: {sorted(alive)}")
+
+    stopping = False
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in alive:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    time.sleep(2)
+    report_memory([os.getpid()], "supervisor")
+    report_memory(sorted(alive))
+
+    last_report = time.monotonic()
+    while alive:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            alive.discard(pid)
+            if not stopping:
+                # Keep the pool at full size: a crashed worker is replaced.
+                replacement = fork_worker()
+                alive.add(replacement)
+                if stopping:
+                    os.kill(replacement, signal.SIGTERM)
+                print(
+                    f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}; "
+                    f"started {replacement}"
+                )
+            continue
+        if args.report_interval and time.monotonic() - last_report > args.report_interval:
+            report_memory(sorted(alive))
+            last_report = time.monotonic()
+        time.sleep(0.5)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+import os
+import time
+import argparse
+import pandas as pd
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression, Ridge
+from sklearn.model_selection import KFold, train_test_split
+from sklearn.metrics import mean_absolute_error, accuracy_score
+
+from monitoring import DriftMonitor
+from model2 import (
+    AdvancedPredictionModel,
+    BasePredictionModel,
+    NeighboursPredictionModel,
+    OnlinePredictionModel,
+    PredictionModel,
+    TextCleaner,
+    TfidfFeatures,
+    dump_atomic,
+    safe_parse_list,
+)
+
+def calculate_jaccard(list1: list, list2: list) -> float:
+    s1 = set(list1) if isinstance(list1, (list, tuple)) else set()
+    s2 = set(list2) if isinstance(list2, (list, tuple)) else set()
+
+    if not s1 and not s2:
+        return 1.0
+
+    intersection = len(s1.intersection(s2))
+    union = len(s1.union(s2))
+    return intersection / union if union > 0 else 0.0
+
+def evaluate_models(base_model, adv_model, df_test):
+    print("\n--- Evaluation on Test Set ---")
+    
+    classification_targets = ['room_type', 'property_type', 'bathrooms_text']
+    regression_targets = ['bedrooms', 'beds', 'accommodates']
+    regex_targets = ['amenities']
+    
+    results = []
+    
+    for target in classification_targets + regression_targets + regex_targets:
+        if target not in df_test.columns:
+            print(f"Warning: Column {target} missing in test set.")
+            continue
+        
+        valid_test = df_test.dropna(subset=[target, "description"])
+        if valid_test.empty:
+            continue
+
+        if target == 'amenities':
+            metric_name = "Jaccard"
+            
+            y_true = valid_test[target].apply(safe_parse_list)
+            
+            y_pred_base = valid_test["description"].apply(lambda x: base_model.predict(x).get(target, []))
+            y_pred_adv = valid_test["description"].apply(lambda x: adv_model.predict(x).get(target, []))
+            
+            score_base = np.mean([calculate_jaccard(p, t) for p, t in zip(y_pred_base, y_true)])
+            score_adv = np.mean([calculate_jaccard(p, t) for p, t in zip(y_pred_adv, y_true)])
+            
+            improvement = score_adv - score_base
+        else:
+            y_true = valid_test[target]
+            base_val = base_model.predict("")[target]
+            y_pred_base = [base_val] * len(valid_test)            
+            y_pred_adv = valid_test["description"].apply(lambda x: adv_model.predict(x).get(target, 0))
+
+            if target in regression_targets:
+                metric_name = "MAE"
+                score_base = mean_absolute_error(y_true, y_pred_base)
+                score_adv = mean_absolute_error(y_true, y_pred_adv)
+                improvement = score_base - score_adv 
+            else:
+                metric_name = "Accuracy"
+                score_base = accuracy_score(y_true, y_pred_base)
+                score_adv = accuracy_score(y_true, y_pred_adv)
+                improvement = score_adv - score_base
+
+        results.append({
+            "Target": target,
+            "Metric": metric_name,
+            "Base model score": round(score_base, 4),
+            "Advanced model score": round(score_adv, 4),
+            "Improvement": round(improvement, 4),
+            "Status": "SUKCES" if improvement >= 0 else "PORAŻKA"
+        })
+
+    print(pd.DataFrame(results))
+                
+
+def score_model(model, df_test) -> dict:
+    """
+    Scores a single model with the metrics used in evaluate_models.
+    Returns {target: (metric_name, score)}.
+    """
+    data = df_test.dropna(subset=["description"])
+    predictions = [model.predict(description) for description in data["description"]]
+    scores = {}
+
+    for target in PredictionModel.TARGETS_CLASS + PredictionModel.TARGETS_REG + ["amenities"]:
+        if target not in data.columns:
+            continue
+        mask = data[target].notna().to_numpy()
+        if not mask.any():
+            continue
+
+        y_true = data[target][mask]
+        y_pred = [p.get(target) for p, keep in zip(predictions, mask) if keep]
+
+        if target == "amenities":
+            y_true = y_true.apply(safe_parse_list)
+            scores[target] = ("Jaccard", float(np.mean(
+                [calculate_jaccard(p, t) for p, t in zip(y_pred, y_true)]
+            )))
+        elif target in PredictionModel.TARGETS_REG:
+            y_pred = [0 if p is None else p for p in y_pred]
+            scores[target] = ("MAE", mean_absolute_error(y_true, y_pred))
+        else:
+            scores[target] = ("Accuracy", accuracy_score(y_true.astype(str), [str(p) for p in y_pred]))
+
+    return scores
+
+# Search space of tune_hyperparameters. Vectorizer entries are overrides of
+# AdvancedPredictionModel.tfidf_params; the first one keeps the defaults.
+TUNING_VECTORIZER_GRID = [
+    {},
+    {"sublinear_tf": True},
+    {"ngram_range": (1, 1)},
+    {"min_df": 2, "max_features": 10000},
+]
+TUNING_MODEL_GRID = {
+    "classification": [{"C": c} for c in (0.3, 1.0, 3.0, 10.0)],
+    "regression": [{"alpha": a} for a in (0.3, 1.0, 3.0, 10.0)],
+}
+
+def _fit_fold_features(tfidf_params, texts, train_idx, val_idx):
+    vectorizer = TfidfVectorizer(**tfidf_params)
+    return vectorizer.fit_transform(texts[train_idx]), vectorizer.transform(texts[val_idx])
+
+def _score_candidate(target, model_params, X_train, y_train, X_val, y_val):
+    if target in PredictionModel.TARGETS_REG:
+        model = Ridge(**model_params).fit(X_train, y_train)
+        return -mean_absolute_error(y_val, np.round(model.predict(X_val)))
+
+    model = LogisticRegression(max_iter=2000, solver="lbfgs", **model_params)
+    return accuracy_score(y_val, model.fit(X_train, y_train).predict(X_val))
+
+def tune_hyperparameters(model, df_train, cv=3, time_budget=600.0, n_jobs=-1):
+    """
+    Cross-validated search over TUNING_VECTORIZER_GRID x TUNING_MODEL_GRID for
+    every target of an AdvancedPredictionModel.
+    Descriptions are cleaned once, and each vectorizer setting is fitted once
+    per fold and shared by all targets and model candidates. Vectorizer
+    settings are tried in order, one model candidate (all folds) at a time,
+    and the deadline is checked before every fold featurization and every
+    candidate, so the search overruns time_budget (seconds) by at most one
+    such step. The budget
+    covers only the search, not the final learn() with the best settings.
+    Targets never reached keep the default parameters.
+    The best settings are written to model.target_params.
+    Returns {target: {"score": ..., "tfidf": {...}, "model": {...}}}.
+    """
+    start = time.monotonic()
+    deadline = start + time_budget
+    data = df_train.dropna(subset=["description"]).reset_index(drop=True)
+    print(f"  [Tuning] {cv}-fold search on {len(data)} rows, budget {time_budget:.0f}s...")
+
+    texts = np.asarray(TextCleaner().transform(data["description"]), dtype=object)
+    folds = list(KFold(n_splits=cv, shuffle=True, random_state=42).split(texts))
+    targets = [
+        t for t in PredictionModel.TARGETS_CLASS + PredictionModel.TARGETS_REG
+        if t in data.columns
+    ]
+    best = {}
+    exhausted = False
+
+    with Parallel(n_jobs=n_jobs) as parallel:
+        for vec_update in TUNING_VECTORIZER_GRID:
+            if time.monotonic() > deadline:
+                exhausted = True
+                break
+
+            tfidf_params = {**model.tfidf_params, **vec_update}
+            # The winner is served by TfidfFeatures; fail before searching it.
+            TfidfFeatures.check_supported(TfidfVectorizer(**tfidf_params))
+            features = parallel(
+                delayed(_fit_fold_features)(tfidf_params, texts, train_idx, val_idx)
+                for train_idx, val_idx in folds
+            )
+
+            for target in targets:
+                y = data[target].to_numpy()
+                known = data[target].notna().to_numpy()
+                kind = "regression" if target in PredictionModel.TARGETS_REG else "classification"
+                for model_params in TUNING_MODEL_GRID[kind]:
+                    if time.monotonic() > deadline:
+                        exhausted = True
+                        break
+
+                    scores = parallel(
+                        delayed(_score_candidate)(
+                            target, model_params,
+                            X_train[known[train_idx]], y[train_idx][known[train_idx]],
+                            X_val[known[val_idx]], y[val_idx][known[val_idx]],
+                        )
+                        for (train_idx, val_idx), (X_train, X_val) in zip(folds, features)
+                    )
+                    score = float(np.mean(scores))
+                    if target not in best or score > best[target]["score"]:
+                        best[target] = {
+                            "score": round(score, 4),
+                            "tfidf": vec_update,
+                            "model": model_params,
+                        }
+                if exhausted:
+                    break
+
+            if exhausted:
+                break
+            print(f"    Evaluated vectorizer {vec_update or 'defaults'} "
+                  f"({time.monotonic() - start:.1f}s elapsed)")
+
+    if exhausted:
+        print(f"    Time budget exhausted after {time.monotonic() - start:.1f}s, "
+              "stopping search.")
+
+    model.target_params = {
+        target: {"tfidf": result["tfidf"], "model": result["model"]}
+        for target, result in best.items()
+    }
+    for target, result in best.items():
+        print(f"    {target}: {result}")
+    return best
+
+def served_predictors(base_model, advanced_model, neighbours_model=None, online_model=None):
+    """Predict function of every model a route serves, by its drift monitor name."""
+    served = {
+        "baseline": base_model.predict,
+        "advanced": advanced_model.predict,
+        "tiered": advanced_model.predict_tiered,
+    }
+    if neighbours_model is not None:
+        served["neighbours"] = neighbours_model.predict
+    if online_model is not None:
+        served["online"] = online_model.predict
+    return served
+
+def fit_drift_reference(drift_monitor, advanced_model, served, df_reference, learning=()):
+    """
+    Fits the drift reference on descriptions the models were not trained on
+    (on their own training rows they are overconfident, and the neighbours
+    model retrieves the row itself): the advanced model's vocabulary for the
+    input sketches and, per served model name, that model's predictions for
+    the prediction sketches. `learning` names models that keep learning online.
+    """
+    vocabulary, stop_words = set(), set()
+    for features in advanced_model.vectorizers.values():
+        vocabulary.update(term for term in features.vocabulary if " " not in term)
+        stop_words.update(features.stop_words)
+    descriptions = df_reference["description"].dropna().tolist()
+    predictions = {
+        name: [predict(description) for description in descriptions]
+        for name, predict in served.items()
+    }
+    return drift_monitor.fit_reference(
+        descriptions, predictions, vocabulary, stop_words, learning=learning
+    )
+
+def train_and_evaluate(base_model, advanced_model, csv_path="listings1.csv", train_ratio=0.8, save_path="models.pkl",
+                       neighbours_model=None, index_path="neighbours_index.pkl", tuning=None,
+                       online_model=None, online_path="online_model.pkl",
+                       online_state_path="online_state.pkl", drift_monitor=None):
+    if not (0 < train_ratio < 1):
+        raise ValueError("train_ratio must be between 0 and 1")
+
+    print(f"1. Loading data from {csv_path}...")
+    try:
+        df = pd.read_csv(csv_path)
+    except FileNotFoundError:
+        print(f"Error: {csv_path} not found.")
+        return
+
+    df.dropna(subset=["description"])
+
+    print(f"2. Splitting data (Train: {train_ratio:.0%}, Test: {1-train_ratio:.0%})...")
+    df_train, df_test = train_test_split(df, train_size=train_ratio, random_state=42)
+
+    base_model.learn(df_train)
+    tuning_results = None
+    if tuning is not None:
+        tuning_results = tune_hyperparameters(advanced_model, df_train, **tuning)
+    advanced_model.learn(df_train)
+    if neighbours_model is not None:
+        neighbours_model.learn(df_train)
+    if online_model is not None:
+        online_model.learn(df_train)
+
+    artifacts = {
+        "base_model": base_model, 
+        "advanced_model": advanced_model
+    }
+    if tuning_results is not None:
+        artifacts["tuning"] = tuning_results
+    if drift_monitor is not None:
+        served = served_predictors(base_model, advanced_model, neighbours_model, online_model)
+        fit_drift_reference(drift_monitor, advanced_model, served, df_test, learning=["online"])
+        artifacts["drift_monitor"] = drift_monitor
+    dump_atomic(artifacts, save_path)
+    print(f"\nModels saved to {save_path}")
+
+    if neighbours_model is not None:
+        neighbours_model.save(index_path)
+        print(f"Neighbours index saved to {index_path}")
+
+    if online_model is not None:
+        dump_atomic(online_model.export(), online_path)
+        dump_atomic(online_model, online_state_path)
+        print(f"Online model saved to {online_path} (learner state: {online_state_path})")
+
+    evaluate_models(base_model, advanced_model, df_test)
+
+def main():
+    parser = argparse.ArgumentParser(description="Training tools for the offer suggestion models.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name, help_text in [
+        ("train", "Train, save and evaluate the models."),
+        ("tune", "Cross-validated hyperparameter search, then train with the best config."),
+    ]:
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument("--csv", default="listings1.csv")
+        sub.add_argument("--save-path", default="models.pkl")
+        for option, default in [
+            ("--index-path", "neighbours_index.pkl"),
+            ("--online-path", "online_model.pkl"),
+            ("--online-state-path", "online_state.pkl"),
+        ]:
+            sub.add_argument(option, help=f"Defaults to {default} next to --save-path.")
+
+    tune_parser = subparsers.choices["tune"]
+    tune_parser.add_argument("--cv", type=int, default=3)
+    tune_parser.add_argument("--time-budget", type=float, default=600.0,
+                             help="Seconds for the search; no new fold featurization or candidate "
+                             "is started after it runs out. The final training is not counted.")
+    tune_parser.add_argument("--n-jobs", type=int, default=-1)
+
+    args = parser.parse_args()
+    save_dir = os.path.dirname(args.save_path)
+    index_path = args.index_path or os.path.join(save_dir, "neighbours_index.pkl")
+    online_path = args.online_path or os.path.join(save_dir, "online_model.pkl")
+    online_state_path = args.online_state_path or os.path.join(save_dir, "online_state.pkl")
+    tuning = None
+    if args.command == "tune":
+        tuning = {"cv": args.cv, "time_budget": args.time_budget, "n_jobs": args.n_jobs}
+
+    train_and_evaluate(
+        BasePredictionModel(),
+        AdvancedPredictionModel(),
+        csv_path=args.csv,
+        save_path=args.save_path,
+        neighbours_model=NeighboursPredictionModel(),
+        index_path=index_path,
+        online_model=OnlinePredictionModel(),
+        online_path=online_path,
+        online_state_path=online_state_path,
+        drift_monitor=DriftMonitor(),
+        tuning=tuning,
+    )
+
+if __name__ == "__main__":
+    main()